@@ -0,0 +1,98 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This script compares the regex and the fast path of RawTraceParser over the
+bundled traces. It first checks that both produce identical commands, then
+times them line by line (next()) and in bulk (parseLines()). It needs CPython:
+    python ParserBenchmark.py [--rounds N] [TRACE_DIR ...]
+"""
+
+import os, sys, inspect, glob, time, argparse
+
+
+def module_path():
+    ''' returns the module path without the use of __file__.
+    from http://stackoverflow.com/questions/729583/getting-file-path-of-imported-module'''
+    return os.path.abspath(os.path.dirname(inspect.getsourcefile(module_path)))
+
+
+sys.path.append(module_path())
+sys.path.append(os.path.join(module_path(), '..', 'src'))
+
+from TraceManipulation import RawTraceParser
+
+DEFAULT_DIRS = ['Emulator', 'Phone', 'Tablet']
+
+
+def commandKey(e):
+    return (e.timestamp, e.evType, e.evCmd, e.evVal)
+
+
+def checkIdentical(lines):
+    regex = RawTraceParser(fastPath=False).parseLines(lines)
+    fast = RawTraceParser(fastPath=True).parseLines(lines)
+    for (a, b) in zip(regex, fast):
+        if commandKey(a) != commandKey(b):
+            print("MISMATCH %s != %s" % (commandKey(a), commandKey(b)))
+            sys.exit(1)
+
+
+def timeLines(parser, lines):
+    start = time.perf_counter()
+    for line in lines:
+        parser.next(line)
+    return time.perf_counter() - start
+
+
+def timeBulk(parser, lines):
+    start = time.perf_counter()
+    parser.parseLines(lines)
+    return time.perf_counter() - start
+
+
+def best(fn, fastPath, lines, rounds):
+    """ The best of several rounds, each with a fresh parser (cold cache)
+    """
+    return min([fn(RawTraceParser(fastPath), lines) for _ in range(rounds)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RawTraceParser")
+    parser.add_argument('dirs', nargs='*', help="trace directories (default: the bundled ones)")
+    parser.add_argument('--rounds', type=int, default=7)
+    args = parser.parse_args()
+    dirs = args.dirs or [os.path.join(module_path(), '..', 'traces', d) for d in DEFAULT_DIRS]
+    lines = []
+    for d in dirs:
+        for path in sorted(glob.glob(os.path.join(d, '*.txt'))):
+            fp = open(path)
+            lines.extend([l for l in fp.readlines() if l.strip()])
+            fp.close()
+    checkIdentical(lines)
+    print("%d lines, regex and fast path agree" % len(lines))
+    for (name, fn) in (("next()", timeLines), ("parseLines()", timeBulk)):
+        slow = best(fn, False, lines, args.rounds)
+        fast = best(fn, True, lines, args.rounds)
+        print("%-13s regex %9.0f lines/s   fast %9.0f lines/s   x%.2f" % (
+            name, len(lines) / slow, len(lines) / fast, slow / fast))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This script compares the single-process Pipeline.execute with a pipeline
+whose parsing stages run in a worker process (ProcessSpan). It needs CPython
+(multiprocessing), not monkeyrunner:
+    python ProcessSpanBenchmark.py [TRACE_DIR] [REPEAT]
+"""
+
+import os, sys, inspect, glob, time
+
+
+def module_path():
+    ''' returns the module path without the use of __file__.
+    from http://stackoverflow.com/questions/729583/getting-file-path-of-imported-module'''
+    return os.path.abspath(os.path.dirname(inspect.getsourcefile(module_path)))
+
+
+sys.path.append(module_path())
+sys.path.append(os.path.join(module_path(), '..', 'src'))
+
+from Pipeline import Pipeline, PipelineComponent, PipelineParcel, ProcessSpan
+import TraceManipulation as dtm
+from TraceBenchmark import RepeatedLineReader
+
+
+class TrailCounter(PipelineComponent):
+    """ A sink counting trails and the motion events in them
+    """
+
+    def __init__(self):
+        self.trails = 0
+        self.events = 0
+
+    def next(self, trail):
+        self.trails += 1
+        self.events += len(trail)
+        return PipelineParcel.EMPTY
+
+
+def parsingStages():
+    return [dtm.RawTraceParser(), dtm.MultiTouchTypeAParser(), dtm.FingerDecomposer()]
+
+
+def run(lines, repeat, useProcess):
+    pl = Pipeline()
+    pl.addStep(RepeatedLineReader(lines, repeat))
+    if useProcess:
+        pl.addStep(ProcessSpan(parsingStages()))
+    else:
+        for stage in parsingStages():
+            pl.addStep(stage)
+    counter = TrailCounter()
+    pl.addStep(counter)
+    start = time.time()
+    pl.execute()
+    return (time.time() - start, counter.trails, counter.events)
+
+
+def main():
+    traceDir = os.path.join(module_path(), '..', 'traces', 'Tablet')
+    if len(sys.argv) > 1:
+        traceDir = sys.argv[1]
+    repeat = 1
+    if len(sys.argv) > 2:
+        repeat = int(sys.argv[2])
+    print("%-45s %10s %10s %8s" % ("trace", "inline(s)", "process(s)", "trails"))
+    for path in sorted(glob.glob(os.path.join(traceDir, '*.txt'))):
+        fp = open(path)
+        lines = fp.readlines()
+        fp.close()
+        (inline, trails, events) = run(lines, repeat, False)
+        (spanned, ptrails, pevents) = run(lines, repeat, True)
+        assert (trails, events) == (ptrails, pevents), "outputs differ for " + path
+        print("%-45s %10.3f %10.3f %8d" % (os.path.basename(path), inline, spanned, trails))
+
+
+if __name__ == "__main__":
+    main()
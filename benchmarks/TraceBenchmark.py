@@ -0,0 +1,188 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This script benchmarks the trace processing hot path (MappedTraceReader ->
+RawTraceParser -> MT parser -> FingerDecomposer) over the bundled traces. It
+reports lines/s, motion events/s and trails/s per trace, optionally the time
+spent in every stage and the peak memory. With -o, everything is also written
+to a JSON file so that runs of different commits can be compared. It needs
+CPython:
+    python TraceBenchmark.py [-o results.json] [--stages] [--memory]
+                             [--scale-to BYTES] [TRACE_DIR ...]
+With --scale-to, every trace is replayed from memory over and over until
+about BYTES of input went through the pipeline, to measure GB-sized inputs
+without storing them.
+"""
+
+import os, sys, inspect, glob, time, json, platform, subprocess, argparse, io, contextlib
+
+
+def module_path():
+    ''' returns the module path without the use of __file__.
+    from http://stackoverflow.com/questions/729583/getting-file-path-of-imported-module'''
+    return os.path.abspath(os.path.dirname(inspect.getsourcefile(module_path)))
+
+
+sys.path.append(module_path())
+sys.path.append(os.path.join(module_path(), '..', 'src'))
+
+from Pipeline import PipelineComponent, PipelineParcel
+from BatchRunner import buildAnalysisPipeline, detectParserType
+
+DEFAULT_DIRS = ['Emulator', 'Phone', 'Tablet']
+
+
+class RepeatedLineReader(PipelineComponent):
+    """ Produce the given lines over and over, a given number of times
+    """
+
+    def __init__(self, lines, repeat):
+        self.lines = lines
+        self.repeat = repeat
+        self.pos = 0
+
+    def next(self, dummy):
+        if self.pos >= len(self.lines) * self.repeat:
+            return PipelineParcel.EMPTY
+        line = self.lines[self.pos % len(self.lines)]
+        self.pos += 1
+        parcel = PipelineParcel()
+        parcel.enqueue(line)
+        return parcel
+
+
+def runOnce(path, parserType, repeat, instrumented=False):
+    """ Run the hot path over a trace and return (seconds, pipeline, stats)
+    """
+    reader = None
+    if repeat > 1:
+        fp = open(path)
+        reader = RepeatedLineReader(fp.readlines(), repeat)
+        fp.close()
+    (pl, stats) = buildAnalysisPipeline(path, parserType, reader)
+    pl.enableInstrumentation(instrumented)
+    # the parsers warn on stdout about every event they skip
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        pl.execute()
+        elapsed = time.perf_counter() - start
+    return (elapsed, pl, stats)
+
+
+def benchmarkTrace(path, args):
+    size = os.path.getsize(path)
+    repeat = 1
+    if args.scale_to:
+        repeat = max(1, args.scale_to // max(size, 1))
+    parserType = detectParserType(path)
+    (elapsed, pl, stats) = runOnce(path, parserType, repeat)
+    counts = [n for (_, n) in pl.getStageCounts()]
+    # the parser also received the final EOF
+    lines = counts[1] - 1
+    events = stats.getResult()["events"]
+    trails = stats.getResult()["trails"]
+    result = {
+        "trace": os.path.relpath(path, os.path.join(module_path(), '..')),
+        "parser": parserType,
+        "bytes": size * repeat,
+        "repeat": repeat,
+        "seconds": elapsed,
+        "lines": lines,
+        "events": events,
+        "trails": trails,
+        "lines_per_s": lines / elapsed,
+        "events_per_s": events / elapsed,
+        "trails_per_s": trails / elapsed,
+        "mb_per_s": size * repeat / elapsed / 1e6,
+    }
+    if args.stages:
+        (_, ipl, _) = runOnce(path, parserType, repeat, True)
+        result["stages"] = [{"stage": m.name, "in": m.itemsIn, "out": m.itemsOut,
+                             "next_s": m.nextTime, "eof_s": m.eofTime,
+                             "p99_us": m.percentile(99) * 1e6}
+                            for m in ipl.getMetrics()]
+    if args.memory:
+        import tracemalloc
+        tracemalloc.start()
+        runOnce(path, parserType, repeat)
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def gitRevision():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=module_path(), stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trace parsing hot path")
+    parser.add_argument('dirs', nargs='*', help="trace directories (default: the bundled ones)")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--stages', action='store_true', help="also time every stage")
+    parser.add_argument('--memory', action='store_true', help="also measure peak memory")
+    parser.add_argument('--scale-to', type=int, default=0, metavar='BYTES',
+                        help="repeat every trace until about BYTES were processed")
+    args = parser.parse_args()
+    dirs = args.dirs or [os.path.join(module_path(), '..', 'traces', d) for d in DEFAULT_DIRS]
+    results = []
+    for d in dirs:
+        for path in sorted(glob.glob(os.path.join(d, '*.txt'))):
+            r = benchmarkTrace(path, args)
+            results.append(r)
+            print("%-45s %10.0f lines/s %10.0f events/s %8.1f trails/s" % (
+                os.path.basename(path), r["lines_per_s"], r["events_per_s"], r["trails_per_s"]))
+    totalSeconds = sum([r["seconds"] for r in results])
+    summary = {
+        "seconds": totalSeconds,
+        "lines_per_s": sum([r["lines"] for r in results]) / totalSeconds,
+        "events_per_s": sum([r["events"] for r in results]) / totalSeconds,
+        "trails_per_s": sum([r["trails"] for r in results]) / totalSeconds,
+    }
+    try:
+        import resource
+        # kilobytes on Linux
+        summary["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+    report = {
+        "revision": gitRevision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale_to": args.scale_to,
+        "summary": summary,
+        "traces": results,
+    }
+    print("TOTAL %.0f lines/s %.0f events/s %.1f trails/s" % (
+        summary["lines_per_s"], summary["events_per_s"], summary["trails_per_s"]))
+    if args.output:
+        fp = open(args.output, 'w')
+        json.dump(report, fp, indent=2, sort_keys=True)
+        fp.close()
+        print("results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This script analyzes all traces of a directory in parallel and prints one
+merged report. It runs with plain CPython, no device is needed. With a
+CACHE_DIR, the parsed trails are kept there so that later runs skip parsing
+"""
+
+import os, sys, inspect
+
+
+def module_path():
+    ''' returns the module path without the use of __file__.
+    from http://stackoverflow.com/questions/729583/getting-file-path-of-imported-module'''
+    return os.path.abspath(os.path.dirname(inspect.getsourcefile(module_path)))
+
+
+sys.path.append(module_path())
+sys.path.append(os.path.join(module_path(), '..', 'src'))
+
+from BatchRunner import runBatch, formatReport
+from TrailCache import TrailCache
+
+
+def main():
+    if len(sys.argv) <= 1:
+        print("Usage: python BatchTraceAnalyzer.py TRACE_DIR [A|B|auto] [PROCESSES] [CACHE_DIR]")
+        print("The traces must be generated from getevent -lt [EVDEV] or getevent -t [EVDEV]")
+        return 1
+    parserType = "auto"
+    if len(sys.argv) > 2:
+        parserType = sys.argv[2]
+    processes = None
+    if len(sys.argv) > 3:
+        processes = int(sys.argv[3])
+    cache = None
+    if len(sys.argv) > 4:
+        cache = TrailCache(sys.argv[4])
+    report = runBatch(sys.argv[1], parserType, processes, cache=cache)
+    print(formatReport(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This script converts `getevent -lt` text traces into the binary trace format
+of BinaryTrace. The display size and evdev limits to record can be given on
+the command line, since no device is needed
+"""
+
+import os, sys, inspect
+
+
+def module_path():
+    ''' returns the module path without the use of __file__.
+    from http://stackoverflow.com/questions/729583/getting-file-path-of-imported-module'''
+    return os.path.abspath(os.path.dirname(inspect.getsourcefile(module_path)))
+
+
+sys.path.append(module_path())
+sys.path.append(os.path.join(module_path(), '..', 'src'))
+
+from BinaryTrace import convertTextTrace
+
+
+def main():
+    if len(sys.argv) <= 2:
+        print("Usage: python ConvertTrace.py TRACE_TXT TRACE_BIN [WIDTHxHEIGHT [XMIN:XMAX YMIN:YMAX]]")
+        print("The trace must be generated from getevent -lt [EVDEV]")
+        return 1
+    (width, height) = (0, 0)
+    if len(sys.argv) > 3:
+        (width, height) = [int(v) for v in sys.argv[3].split('x')]
+    limits = None
+    if len(sys.argv) > 5:
+        limits = {}
+        for (axis, arg) in zip(("ABS_MT_POSITION_X", "ABS_MT_POSITION_Y"), sys.argv[4:6]):
+            (lo, hi) = [int(v) for v in arg.split(':')]
+            limits[axis] = {"min": lo, "max": hi}
+    convertTextTrace(sys.argv[1], sys.argv[2], width, height, limits)
+    print("%s: %d -> %d bytes" % (sys.argv[1], os.path.getsize(sys.argv[1]),
+                                  os.path.getsize(sys.argv[2])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+""" This module provides an asyncio runtime for pipelines. Stages may define
+`async def next(self, obj)` and/or `async def handleEOF(self)` to await
+socket or device I/O; plain PipelineComponents are called directly, so
+existing stages run unchanged. Many pipelines (e.g. one per device) can share
+a single event loop through runPipelines.
+It requires Python 3 (asyncio), hence it lives apart from Pipeline, which
+must remain importable by monkeyrunner.
+"""
+
+import asyncio, inspect
+from Pipeline import Pipeline, PipelineParcel, _InstrumentedStage, _clock
+
+
+class AsyncPipeline(Pipeline):
+    """ A pipeline whose stages may be coroutines. Objects are delivered in
+    exactly the same order as Pipeline.execute does
+    """
+
+    async def run(self):
+        """ Run the pipeline on the current event loop until the first stage
+        returns no further data
+        """
+        original = self._prepare()
+        try:
+            await self._runAsync()
+        finally:
+            self._restore(original)
+
+    async def _runAsync(self):
+        first = self.pl[0]
+        self.stageCounts = [0] * len(self.pl)
+        while True:
+            self.stageCounts[0] += 1
+            parcel = await _call(first.next, None)
+            if parcel.isEmpty():
+                await self._dispatchAsync(1, PipelineParcel((Pipeline.EOF,)))
+                break
+            await self._dispatchAsync(1, parcel)
+            # let other pipelines sharing the loop make progress even if
+            # none of the stages ever awaits
+            await asyncio.sleep(0)
+
+    def execute(self):
+        """ Run the pipeline on a fresh event loop, blocking until done
+        """
+        asyncio.run(self.run())
+
+    async def _dispatchAsync(self, index, parcel):
+        """ Intended for internal use only
+        The awaiting counterpart of Pipeline._dispatch
+        """
+        pl = self.pl
+        counts = self.stageCounts
+        last = len(pl)
+        eof = Pipeline.EOF
+        stack = [(index, parcel)]
+        while stack:
+            (index, parcel) = stack[-1]
+            if parcel.isEmpty():
+                stack.pop()
+                continue
+            obj = parcel.dequeue()
+            if index >= last:
+                continue
+            counts[index] += 1
+            if obj == eof:
+                out = await _call(pl[index].handleEOF)
+            else:
+                out = await _call(pl[index].next, obj)
+            if not out.isEmpty():
+                stack.append((index + 1, out))
+
+
+class _AsyncInstrumentedStage(_InstrumentedStage):
+    """ A timing proxy that also accounts for the time a coroutine stage
+    spends awaiting
+    """
+
+    async def next(self, obj):
+        start = _clock()
+        out = await _call(self.stage.next, obj)
+        self.metrics.recordNext(_clock() - start, len(out))
+        return out
+
+    async def handleEOF(self):
+        start = _clock()
+        out = await _call(self.stage.handleEOF)
+        self.metrics.recordEOF(_clock() - start, len(out))
+        return out
+
+
+AsyncPipeline._instrumentedStageClass = _AsyncInstrumentedStage
+
+
+async def _call(method, *args):
+    """ Call a stage method, awaiting its result if it is a coroutine
+    """
+    result = method(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def runPipelinesAsync(pipelines):
+    """ Run several pipelines concurrently on the current event loop.
+    Returns once all of them are done, raising the first failure
+    """
+    await asyncio.gather(*[p.run() for p in pipelines])
+
+
+def runPipelines(pipelines):
+    """ Run several pipelines concurrently on one fresh event loop
+    """
+    asyncio.run(runPipelinesAsync(pipelines))
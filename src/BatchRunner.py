@@ -0,0 +1,166 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This module analyzes a whole directory of traces at once. Every trace goes
+through the same pipeline (reader -> RawTraceParser, or NumericTraceParser
+for `getevent -t` traces -> MT parser -> FingerDecomposer ->
+TrailStatistics) and the traces are spread over a pool of worker processes.
+The per-trace results are merged into one report.
+It needs the multiprocessing module, hence CPython rather than monkeyrunner.
+"""
+
+import os, re, glob
+from Pipeline import Pipeline, PullPipeline
+import TraceManipulation as dtm
+from TrailCache import CachedTrailReader
+
+
+# a line of `getevent -t`, and one setting ABS_MT_SLOT
+NUMERIC_LINE = re.compile(r"\[\s*\d+\.\d+\]\s*[0-9a-fA-F]{4}\s+[0-9a-fA-F]{4}\s+[0-9a-fA-F]{8}\s*$")
+NUMERIC_SLOT = re.compile(r"\]\s*0003\s+002f\s")
+
+
+def _headLines(tracePath, lines):
+    fp = dtm.openTrace(tracePath)
+    try:
+        head = []
+        for _ in range(lines):
+            line = fp.readline()
+            if line == "":
+                break
+            head.append(line)
+    finally:
+        fp.close()
+    return head
+
+
+def detectParserType(tracePath, lines=200):
+    """ Guess the multi-touch protocol of a trace from its first lines:
+    "B" if it uses slots (ABS_MT_SLOT), "A" otherwise
+    """
+    for line in _headLines(tracePath, lines):
+        if "ABS_MT_SLOT" in line or NUMERIC_SLOT.search(line):
+            return "B"
+    return "A"
+
+
+def isNumericTrace(tracePath, lines=20):
+    """ Whether a trace was dumped by `getevent -t` rather than `getevent -lt`
+    """
+    head = [line for line in _headLines(tracePath, lines) if line.strip()]
+    return len(head) > 0 and NUMERIC_LINE.match(head[0]) is not None
+
+
+def buildAnalysisPipeline(tracePath, parserType="auto", reader=None, cache=None):
+    """ Build the analysis pipeline of a trace, returning the pipeline and its
+    TrailStatistics sink. reader replaces the MappedTraceReader of tracePath,
+    or for a compressed trace, the TextFileLineReader decompressing it.
+    With a TrailCache, the trails come from the cache when it has them
+    """
+    if parserType == "auto":
+        parserType = detectParserType(tracePath)
+    pl = Pipeline()
+    if cache is None:
+        for step in _trailSteps(tracePath, parserType, reader):
+            pl.addStep(step)
+    else:
+        def parse():
+            steps = _trailSteps(tracePath, parserType, reader)
+            trails = PullPipeline(steps[0])
+            for step in steps[1:]:
+                trails.addStep(step)
+            return trails
+        pl.addStep(CachedTrailReader(cache, tracePath, parserType, parse, compactTrails=True))
+    stats = dtm.TrailStatistics()
+    pl.addStep(stats)
+    return (pl, stats)
+
+
+def _trailSteps(tracePath, parserType, reader):
+    """ The steps from reading a trace to its finger trails
+    """
+    if reader is None and tracePath.lower().endswith(dtm.COMPRESSED_EXTENSIONS):
+        reader = dtm.TextFileLineReader(tracePath, decodeThread=True)
+    elif reader is None:
+        reader = dtm.MappedTraceReader(tracePath)
+    steps = [reader]
+    if isNumericTrace(tracePath):
+        steps.append(dtm.NumericTraceParser())
+    else:
+        steps.append(dtm.RawTraceParser())
+    if parserType == "B":
+        steps.append(dtm.MultiTouchTypeBParser(groupReports=True))
+    else:
+        steps.append(dtm.MultiTouchTypeAParser())
+    steps.append(dtm.FingerDecomposer(compactTrails=True))
+    return steps
+
+
+def analyzeTrace(tracePath, parserType="auto", cache=None):
+    """ Run the analysis pipeline over a single trace and return its result
+    """
+    (pl, stats) = buildAnalysisPipeline(tracePath, parserType, cache=cache)
+    pl.execute()
+    return stats.getResult()
+
+
+def _analyzeTraceJob(job):
+    (tracePath, parserType, cache) = job
+    return (tracePath, analyzeTrace(tracePath, parserType, cache))
+
+
+def mergeResults(results):
+    """ Sum up a list of TrailStatistics results
+    """
+    total = {}
+    for result in results:
+        for (key, value) in result.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def runBatch(traceDir, parserType="auto", processes=None, pattern="*.txt", cache=None):
+    """ Analyze every trace of a directory on a pool of processes (one per
+    core by default), with the trails of a TrailCache if given.
+    Returns {"traces": {path: result}, "total": result}
+    """
+    import multiprocessing
+    paths = sorted(glob.glob(os.path.join(traceDir, pattern)))
+    jobs = [(path, parserType, cache) for path in paths]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_analyzeTraceJob, jobs, 1)
+    finally:
+        pool.close()
+        pool.join()
+    perTrace = dict(results)
+    return {"traces": perTrace, "total": mergeResults(perTrace.values())}
+
+
+def formatReport(report):
+    """ Render a report made by runBatch as a text table
+    """
+    row = "%-45s %8s %8s %6s %10s"
+    lines = [row % ("trace", "trails", "events", "taps", "duration")]
+    items = sorted(report["traces"].items()) + [("TOTAL", report["total"])]
+    for (path, r) in items:
+        lines.append(row % (os.path.basename(path), r.get("trails", 0),
+            r.get("events", 0), r.get("taps", 0), "%.3f" % r.get("duration", 0)))
+    return "\n".join(lines)
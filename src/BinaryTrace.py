@@ -0,0 +1,255 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This module provides a compact binary trace format, in place of the text
+output of `getevent -lt`. A file is made of
+    a header: magic "MHBT", version, record size, display width and height,
+    the offset of the label table and the evdev limits of some axes
+    (code, min, max, fuzz, flat, resolution as in the kernel's input_absinfo)
+    fixed-size records, one per event, like the kernel's input_event:
+    timestamp in microseconds (int64), type (uint16), code (uint16) and
+    value (uint32), little-endian
+    a label table, naming the types and codes that EventCodes does not know
+Types and codes are the kernel numbers from EventCodes, so a record takes
+16 bytes instead of about 80 in text.
+"""
+
+import struct
+import EventCodes
+from Pipeline import Pipeline, PipelineComponent, PipelineParcel
+from TraceManipulation import GeteventCommand, TextFileLineReader, RawTraceParser
+
+MAGIC = "MHBT".encode("ascii")
+VERSION = 1
+HEADER = struct.Struct("<4sHHiiQH")
+AXIS = struct.Struct("<Hiiiii")
+RECORD = struct.Struct("<qHHI")
+LABEL = struct.Struct("<BHB")
+AXIS_FIELDS = ("min", "max", "fuzz", "flat", "resolution")
+
+# numbers given to the labels EventCodes does not know
+EXTRA_LABELS = 0xfe00
+_TYPE_LABEL = 0
+_CODE_LABEL = 1
+
+
+class BinaryTraceWriter(PipelineComponent):
+    """ A sink writing getevent commands to a binary trace. limits maps axis
+    labels to what MonkeyHelper.getEvdevLimits returns, e.g.
+        {"ABS_MT_POSITION_X": dev.getEvdevLimits("ABS_MT_POSITION_X"), ...}
+    The file is complete once the writer sees EOF
+    """
+    FLUSH_RECORDS = 4096
+
+    def __init__(self, path, displayWidth=0, displayHeight=0, limits=None):
+        self.fp = open(path, "wb")
+        self.labels = {}
+        self.nextLabel = EXTRA_LABELS
+        self.pending = []
+        axes = []
+        if limits is not None:
+            for (name, limit) in sorted(limits.items()):
+                if limit is None:
+                    continue
+                axes.append(AXIS.pack(EventCodes.codeNumber(name),
+                                      *[limit.get(f, 0) for f in AXIS_FIELDS]))
+        self.fp.write(HEADER.pack(MAGIC, VERSION, RECORD.size, displayWidth,
+                                  displayHeight, 0, len(axes)))
+        self.fp.write("".encode("ascii").join(axes))
+
+    def next(self, e):
+        """ Takes a getevent command and writes its record
+        """
+        evType = self._number(_TYPE_LABEL, 0, e.evType)
+        evCmd = self._number(_CODE_LABEL, evType, e.evCmd)
+        self.pending.append(RECORD.pack(int(round(e.timestamp * 1000000)),
+                                        evType, evCmd, e.evVal))
+        if len(self.pending) >= BinaryTraceWriter.FLUSH_RECORDS:
+            self.flush()
+        return PipelineParcel.EMPTY
+
+    def _number(self, kind, evType, label):
+        """ The number of a label, when EventCodes gives it back unchanged,
+        or else a number of our own, recorded in the label table. Commands
+        from a NumericTraceParser already carry numbers
+        """
+        if not isinstance(label, str):
+            return label
+        key = (kind, evType, label)
+        number = self.labels.get(key)
+        if number is not None:
+            return number
+        if kind == _TYPE_LABEL:
+            number = EventCodes.typeNumber(label)
+            if EventCodes.typeName(number) != label:
+                number = None
+        else:
+            number = EventCodes.codeNumber(label)
+            if EventCodes.codeName(evType, number) != label:
+                number = None
+        if number is None:
+            number = self.nextLabel
+            self.nextLabel += 1
+        self.labels[key] = number
+        return number
+
+    def flush(self):
+        self.fp.write("".encode("ascii").join(self.pending))
+        self.pending = []
+
+    def handleEOF(self):
+        self.close()
+        return PipelineComponent.handleEOF(self)
+
+    def close(self):
+        """ Write the label table and complete the header
+        """
+        if self.fp.closed:
+            return
+        self.flush()
+        offset = self.fp.tell()
+        extra = [(n, kind, t, label) for ((kind, t, label), n) in self.labels.items()
+                 if n >= EXTRA_LABELS]
+        extra.sort()
+        self.fp.write(struct.pack("<H", len(extra)))
+        for (number, kind, evType, label) in extra:
+            name = label.encode("ascii")
+            self.fp.write(LABEL.pack(kind, number, len(name)) + name)
+        self.fp.seek(HEADER.size - 10)
+        self.fp.write(struct.pack("<Q", offset))
+        self.fp.close()
+
+
+class BinaryTraceHeader:
+    """ The device metadata of a binary trace. It answers getEvdevLimits and
+    displayWidth/displayHeight like a device does, so it can stand for the
+    capturing device, e.g. in a DeviceAdjuster
+    """
+
+    def __init__(self, fp):
+        (magic, version, recordSize, self.displayWidth, self.displayHeight,
+         self.labelsOffset, axes) = HEADER.unpack(_readFully(fp, HEADER.size))
+        if magic != MAGIC or recordSize != RECORD.size:
+            raise ValueError("not a binary trace")
+        if version > VERSION:
+            raise ValueError("unsupported binary trace version %d" % version)
+        self.limits = {}
+        for i in range(axes):
+            fields = AXIS.unpack(_readFully(fp, AXIS.size))
+            self.limits[EventCodes.codeName(EventCodes.EV_ABS, fields[0])] = \
+                dict(zip(AXIS_FIELDS, fields[1:]))
+        self.recordsOffset = fp.tell()
+        self.typeNames = {}
+        self.codeNames = {}
+        if self.labelsOffset == 0:
+            # the writer did not complete the file, keep all whole records
+            fp.seek(0, 2)
+            end = fp.tell()
+            self.labelsOffset = end - (end - self.recordsOffset) % RECORD.size
+            fp.seek(self.recordsOffset)
+            return
+        fp.seek(self.labelsOffset)
+        (count,) = struct.unpack("<H", _readFully(fp, 2))
+        for i in range(count):
+            (kind, number, length) = LABEL.unpack(_readFully(fp, LABEL.size))
+            name = _readFully(fp, length).decode("ascii")
+            if kind == _TYPE_LABEL:
+                self.typeNames[number] = str(name)
+            else:
+                self.codeNames[number] = str(name)
+        fp.seek(self.recordsOffset)
+
+    def getEvdevLimits(self, attrib):
+        return self.limits.get(attrib)
+
+    def typeName(self, number):
+        if number in self.typeNames:
+            return self.typeNames[number]
+        return EventCodes.typeName(number)
+
+    def codeName(self, evType, number):
+        if number in self.codeNames:
+            return self.codeNames[number]
+        return EventCodes.codeName(evType, number)
+
+
+class BinaryTraceReader(PipelineComponent):
+    """ A binary trace reader, which takes the place of TextFileLineReader
+    followed by RawTraceParser: every pull produces the getevent commands of
+    up to blockEvents records. header holds the device metadata
+    """
+
+    def __init__(self, path, blockEvents=1024):
+        self.fp = open(path, "rb")
+        self.header = BinaryTraceHeader(self.fp)
+        self.blockEvents = blockEvents
+        self.labels = {}
+
+    def next(self, dummy):
+        """ Takes nothing and produces getevent commands
+        """
+        if self.fp.closed:
+            return PipelineParcel.EMPTY
+        left = self.header.labelsOffset - self.fp.tell()
+        size = min(left, self.blockEvents * RECORD.size)
+        data = self.fp.read(size - size % RECORD.size)
+        if not data:
+            self.fp.close()
+            return PipelineParcel.EMPTY
+        parcel = PipelineParcel()
+        labels = self.labels
+        for offset in range(0, len(data), RECORD.size):
+            (timestamp, evType, evCmd, evVal) = RECORD.unpack_from(data, offset)
+            names = labels.get((evType, evCmd))
+            if names is None:
+                names = (self.header.typeName(evType), self.header.codeName(evType, evCmd))
+                labels[(evType, evCmd)] = names
+            e = GeteventCommand()
+            e.timestamp = timestamp / 1000000.0
+            (e.evType, e.evCmd) = names
+            e.evVal = evVal
+            parcel.enqueue(e)
+        return parcel
+
+    def getState(self):
+        if self.fp.closed:
+            return None
+        return self.fp.tell()
+
+    def setState(self, offset):
+        if offset is not None:
+            self.fp.seek(offset)
+
+
+def convertTextTrace(textPath, binaryPath, displayWidth=0, displayHeight=0, limits=None):
+    """ Convert a `getevent -lt` text trace into a binary trace
+    """
+    pl = Pipeline()
+    pl.addStep(TextFileLineReader(textPath))
+    pl.addStep(RawTraceParser())
+    pl.addStep(BinaryTraceWriter(binaryPath, displayWidth, displayHeight, limits))
+    pl.execute()
+
+
+def _readFully(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise ValueError("truncated binary trace")
+    return data
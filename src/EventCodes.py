@@ -0,0 +1,154 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This module provides the numbers the Linux input subsystem uses for event
+types and codes (see linux/input.h), so that getevent labels such as
+"EV_ABS" or "ABS_MT_POSITION_X" can be turned into small integers and back.
+"""
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_REL = 0x02
+EV_ABS = 0x03
+EV_MSC = 0x04
+EV_SW = 0x05
+EV_LED = 0x11
+EV_SND = 0x12
+EV_REP = 0x14
+EV_FF = 0x15
+EV_PWR = 0x16
+
+TYPES = {
+    "EV_SYN": EV_SYN, "EV_KEY": EV_KEY, "EV_REL": EV_REL, "EV_ABS": EV_ABS,
+    "EV_MSC": EV_MSC, "EV_SW": EV_SW, "EV_LED": EV_LED, "EV_SND": EV_SND,
+    "EV_REP": EV_REP, "EV_FF": EV_FF, "EV_PWR": EV_PWR,
+}
+
+# codes per event type
+CODES = {
+    EV_SYN: {
+        "SYN_REPORT": 0x00, "SYN_CONFIG": 0x01, "SYN_MT_REPORT": 0x02,
+        "SYN_DROPPED": 0x03,
+    },
+    EV_KEY: {
+        "KEY_ESC": 1, "KEY_1": 2, "KEY_2": 3, "KEY_3": 4, "KEY_4": 5,
+        "KEY_5": 6, "KEY_6": 7, "KEY_7": 8, "KEY_8": 9, "KEY_9": 10,
+        "KEY_0": 11, "KEY_BACKSPACE": 14, "KEY_TAB": 15, "KEY_Q": 16,
+        "KEY_W": 17, "KEY_E": 18, "KEY_R": 19, "KEY_T": 20, "KEY_Y": 21,
+        "KEY_U": 22, "KEY_I": 23, "KEY_O": 24, "KEY_P": 25, "KEY_A": 30,
+        "KEY_S": 31, "KEY_D": 32, "KEY_F": 33, "KEY_G": 34, "KEY_H": 35,
+        "KEY_J": 36, "KEY_K": 37, "KEY_L": 38, "KEY_Z": 44, "KEY_X": 45,
+        "KEY_C": 46, "KEY_V": 47, "KEY_B": 48, "KEY_N": 49, "KEY_M": 50,
+        "KEY_SPACE": 57, "KEY_ENTER": 28, "KEY_UP": 103, "KEY_LEFT": 105,
+        "KEY_RIGHT": 106, "KEY_DOWN": 108, "KEY_MUTE": 113,
+        "KEY_VOLUMEDOWN": 114, "KEY_VOLUMEUP": 115, "KEY_POWER": 116,
+        "KEY_MENU": 139, "KEY_BACK": 158, "KEY_HOMEPAGE": 172,
+        "KEY_CAMERA": 212, "KEY_SEARCH": 217, "KEY_APPSELECT": 0x244,
+        "BTN_TOOL_PEN": 0x140, "BTN_TOOL_RUBBER": 0x141,
+        "BTN_TOOL_FINGER": 0x145, "BTN_TOUCH": 0x14a, "BTN_STYLUS": 0x14b,
+        "BTN_STYLUS2": 0x14c, "BTN_TOOL_DOUBLETAP": 0x14d,
+        "BTN_TOOL_TRIPLETAP": 0x14e, "BTN_TOOL_QUADTAP": 0x14f,
+    },
+    EV_REL: {
+        "REL_X": 0x00, "REL_Y": 0x01, "REL_HWHEEL": 0x06, "REL_WHEEL": 0x08,
+    },
+    EV_ABS: {
+        "ABS_X": 0x00, "ABS_Y": 0x01, "ABS_Z": 0x02, "ABS_RX": 0x03,
+        "ABS_RY": 0x04, "ABS_RZ": 0x05, "ABS_THROTTLE": 0x06,
+        "ABS_WHEEL": 0x08, "ABS_HAT0X": 0x10, "ABS_HAT0Y": 0x11,
+        "ABS_PRESSURE": 0x18, "ABS_DISTANCE": 0x19, "ABS_TILT_X": 0x1a,
+        "ABS_TILT_Y": 0x1b,
+        "ABS_TOOL_WIDTH": 0x1c, "ABS_MISC": 0x28, "ABS_MT_SLOT": 0x2f,
+        "ABS_MT_TOUCH_MAJOR": 0x30, "ABS_MT_TOUCH_MINOR": 0x31,
+        "ABS_MT_WIDTH_MAJOR": 0x32, "ABS_MT_WIDTH_MINOR": 0x33,
+        "ABS_MT_ORIENTATION": 0x34, "ABS_MT_POSITION_X": 0x35,
+        "ABS_MT_POSITION_Y": 0x36, "ABS_MT_TOOL_TYPE": 0x37,
+        "ABS_MT_BLOB_ID": 0x38, "ABS_MT_TRACKING_ID": 0x39,
+        "ABS_MT_PRESSURE": 0x3a, "ABS_MT_DISTANCE": 0x3b,
+        "ABS_MT_TOOL_X": 0x3c, "ABS_MT_TOOL_Y": 0x3d,
+    },
+    EV_MSC: {
+        "MSC_SERIAL": 0x00, "MSC_GESTURE": 0x02, "MSC_SCAN": 0x04,
+        "MSC_TIMESTAMP": 0x05,
+    },
+}
+
+# a code not known to the tables
+UNKNOWN = 0xffff
+
+# all code names are distinct across types
+CODE_NUMBERS = {}
+for _codes in CODES.values():
+    CODE_NUMBERS.update(_codes)
+
+TYPE_NAMES = dict([(v, k) for (k, v) in TYPES.items()])
+CODE_NAMES = dict([(t, dict([(v, k) for (k, v) in codes.items()]))
+                   for (t, codes) in CODES.items()])
+
+
+def typeNumber(name):
+    """ The number of an event type label, e.g. "EV_ABS" -> 3. getevent
+    prints types it has no label for in hex, those are converted as is
+    """
+    if name in TYPES:
+        return TYPES[name]
+    return _hexOrUnknown(name)
+
+
+def codeNumber(name, evType=None):
+    """ The number of an event code label, e.g. "ABS_MT_POSITION_X" -> 0x35.
+    Given the number of its type, a label of another type is unknown
+    """
+    if evType is None:
+        codes = CODE_NUMBERS
+    else:
+        codes = CODES.get(evType, {})
+    if name in codes:
+        return codes[name]
+    if name in CODE_NUMBERS:
+        return UNKNOWN
+    return _hexOrUnknown(name)
+
+
+def typeName(number):
+    """ The label of an event type number, or its hex form if unknown
+    """
+    if number in TYPE_NAMES:
+        return TYPE_NAMES[number]
+    return "%04x" % number
+
+
+def codeName(evType, number):
+    """ The label of an event code number of a given type, or its hex form
+    """
+    names = CODE_NAMES.get(evType)
+    if names is not None and number in names:
+        return names[number]
+    return "%04x" % number
+
+
+def _hexOrUnknown(name):
+    try:
+        number = int(name, 16)
+    except ValueError:
+        return UNKNOWN
+    if number >= UNKNOWN:
+        return UNKNOWN
+    return number
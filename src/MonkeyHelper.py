@@ -24,7 +24,7 @@ an android box. You need monkeyrunner to run scripts once including this module
 
 import os, subprocess
 from com.android.monkeyrunner import MonkeyRunner, MonkeyDevice
-from Pipeline import PipelineParcel, PipelineComponent
+from Pipeline import PipelineParcel, PipelineComponent, MapComponent
 from Replayer import Replayer, ReplayEvent
 
 def _cmd(cmdlist, mute=True):
@@ -211,13 +211,11 @@ class GestureReplayEvent(ReplayEvent):
         self.trail = trail
 
 
-class GestureReplayEventWrapper(PipelineComponent):
+class GestureReplayEventWrapper(MapComponent):
     """ Wrap a trail to be a GestureReplayEvent for MonkeyHelperReplayer
     """
-    def next(self, specialEvent):
-        pp = PipelineParcel()
-        pp.enqueue(GestureReplayEvent(specialEvent))
-        return pp
+    def map(self, specialEvent):
+        return GestureReplayEvent(specialEvent)
 
 
 class MonkeyHelperReplayer(Replayer):
@@ -243,7 +241,7 @@ class MonkeyHelperReplayer(Replayer):
             self.device.touch(specialEvent[count].x, specialEvent[count].y, actions[count])
             lastTimeStamp = specialEvent[count].timestamp
         self.setTimestamp(lastTimeStamp)
-        return PipelineParcel()
+        return PipelineParcel.EMPTY
 
     def canAccept(self, replayEvent):
         return isinstance(replayEvent, GestureReplayEvent)
@@ -0,0 +1,289 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This module parses a single large trace on several cores. The file is split
+into byte ranges that begin with a report (taken from its TraceIndex) and
+every range goes through reader -> parser -> MT parser -> FingerDecomposer
+in a worker process, starting from a fresh state.
+The parent stitches the ranges in order: it replays the first commands of a
+range from the true state left by the previous one until both states agree
+(the seam), keeps what the replay produced and the worker's trails after
+the seam, and extends the trails that were open at the seam with their
+continuation. A range whose state does not agree within its first
+seamEvents commands is parsed again serially, so the trails are always the
+same as those of the serial pipeline, in the same order.
+It needs the multiprocessing and mmap modules, hence CPython rather than
+monkeyrunner.
+"""
+
+import bisect
+from Pipeline import PipelineComponent, PipelineParcel
+from BatchRunner import detectParserType, isNumericTrace
+import TraceManipulation as dtm
+
+# the number of commands of a range replayed at most to find its seam
+SEAM_EVENTS = 4096
+
+# the size of the reads of a worker
+CHUNK_BYTES = 1 << 20
+
+
+def splitTrace(tracePath, parts):
+    """ Split a trace into at most parts byte ranges of similar size, each
+    beginning with a report. Returns a list of (start, end)
+    """
+    index = dtm.TraceIndex(tracePath)
+    if not index.offsets:
+        return [(0, None)]
+    size = index.offsets[-1]
+    starts = [0]
+    for k in range(1, parts):
+        i = bisect.bisect_left(index.offsets, size * k // parts)
+        if i < len(index.offsets) and index.offsets[i] > starts[-1]:
+            starts.append(index.offsets[i])
+    ends = starts[1:] + [None]
+    return list(zip(starts, ends))
+
+
+class ParallelTrailReader(PipelineComponent):
+    """ A source producing the finger trails of a trace, as
+        MappedTraceReader -> RawTraceParser (or NumericTraceParser) ->
+        MultiTouchTypeAParser (or MultiTouchTypeBParser(groupReports=True)) ->
+        FingerDecomposer(compactTrails)
+    would, with the parsing spread over processes (one per core by default).
+    Every pull produces the trails of the next range. The trace must not be
+    compressed
+    """
+
+    def __init__(self, tracePath, parserType="auto", processes=None, parts=None,
+                 compactTrails=False, seamEvents=SEAM_EVENTS):
+        import multiprocessing
+        if tracePath.lower().endswith(dtm.COMPRESSED_EXTENSIONS):
+            raise ValueError("parallel parsing needs an uncompressed trace: " + tracePath)
+        if parserType == "auto":
+            parserType = detectParserType(tracePath)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if parts is None:
+            parts = 4 * processes
+        self.tracePath = tracePath
+        self.parserType = parserType
+        self.numeric = isNumericTrace(tracePath)
+        self.compactTrails = compactTrails
+        self.mt = _mtParser(parserType)
+        self.fd = dtm.FingerDecomposer(compactTrails=True)
+        ranges = splitTrace(tracePath, parts)
+        jobs = [(tracePath, start, end, parserType, self.numeric, i > 0 and seamEvents)
+                for (i, (start, end)) in enumerate(ranges)]
+        self.ranges = list(ranges)
+        self.pool = multiprocessing.Pool(min(processes, len(jobs)))
+        self.results = self.pool.imap(_parseRange, jobs)
+
+    def next(self, dummy):
+        """ Takes nothing and produces finger trails
+        """
+        # a range may complete no trail, but an empty parcel ends the pipeline
+        while self.pool is not None:
+            trails = self._nextRange()
+            if trails:
+                if not self.compactTrails:
+                    trails = [[p.clone() for p in trail] for trail in trails]
+                return PipelineParcel(trails)
+        return PipelineParcel.EMPTY
+
+    def _nextRange(self):
+        try:
+            result = next(self.results)
+        except StopIteration:
+            self.close()
+            self.mt.handleEOF()
+            return self.fd.handleEOF().drain()[:-1]
+        (start, end) = self.ranges.pop(0)
+        if start == 0:
+            return self._take(result)
+        return self._stitch(result, start, end)
+
+    def _take(self, result):
+        (trails, head, snapshots, mtState, tracker) = result
+        self.mt.setState(mtState)
+        self.fd.setState(tracker)
+        return trails
+
+    def _stitch(self, result, start, end):
+        (trails, head, snapshots, mtState, tracker) = result
+        counts = dict(self.mt.unknownCounts)
+        produced = []
+        replayed = 0
+        for (i, state, lengths, count) in snapshots:
+            while replayed <= i:
+                produced.extend(_feed(self.mt, self.fd, head[replayed]))
+                replayed += 1
+            if _seamState(self.mt, self.fd) == state:
+                break
+        else:
+            # no seam, parse the range again serially after what was replayed
+            return produced + self._reparse(start, end, replayed)
+        # the trails open at the seam go on in the worker's trails
+        seamTrails = self.fd.tracker
+        pending = dict(zip(state[1], lengths))
+        for trail in trails[count:]:
+            produced.append(_continue(seamTrails, pending, trail))
+        for (trackingId, trail) in tracker.items():
+            tracker[trackingId] = _continue(seamTrails, pending, trail)
+        # the worker counted the unknown commands of the whole range
+        self.mt.setState(mtState)
+        for (key, n) in counts.items():
+            self.mt.unknownCounts[key] = self.mt.unknownCounts.get(key, 0) + n
+        self.fd.setState(tracker)
+        return produced
+
+    def _reparse(self, start, end, skip):
+        reader = dtm.MappedTraceReader(self.tracePath, start, end, chunkBytes=CHUNK_BYTES)
+        parser = _lineParser(self.numeric)
+        trails = []
+        for cmd in _commands(reader, parser):
+            if skip > 0:
+                skip -= 1
+                continue
+            trails.extend(_feed(self.mt, self.fd, cmd))
+        return trails
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def analyzeTraceParallel(tracePath, parserType="auto", processes=None):
+    """ The TrailStatistics result of a trace, as BatchRunner.analyzeTrace
+    computes it, with the parsing spread over processes
+    """
+    from Pipeline import Pipeline
+    pl = Pipeline()
+    pl.addStep(ParallelTrailReader(tracePath, parserType, processes, compactTrails=True))
+    stats = dtm.TrailStatistics()
+    pl.addStep(stats)
+    pl.execute()
+    return stats.getResult()
+
+
+def _mtParser(parserType):
+    if parserType == "B":
+        return dtm.MultiTouchTypeBParser(groupReports=True)
+    return dtm.MultiTouchTypeAParser()
+
+
+def _lineParser(numeric):
+    if numeric:
+        return dtm.NumericTraceParser()
+    return dtm.RawTraceParser()
+
+
+def _commands(reader, parser):
+    while True:
+        parcel = reader.next(None)
+        if parcel.isEmpty():
+            return
+        for lines in parcel.drain():
+            for cmd in parser.parseLines(lines):
+                yield cmd
+
+
+def _feed(mt, fd, cmd):
+    """ Run a command through the MT parser and the FingerDecomposer,
+    returning the trails it completes
+    """
+    trails = []
+    for motions in mt.next(cmd).drain():
+        trails.extend(fd.next(motions).drain())
+    return trails
+
+
+def _isReport(cmd):
+    return (cmd.evType == "EV_SYN" and cmd.evCmd == "SYN_REPORT") or \
+        (cmd.evType == 0 and cmd.evCmd == 0)
+
+
+def _fields(e):
+    if e is None:
+        return None
+    return tuple([getattr(e, name) for name in dtm.MotionEvent.__slots__])
+
+
+_FRESH = _fields(dtm.MotionEvent())
+
+
+def _seamState(mt, fd):
+    """ What the trails after this point depend on: the MT parser state and
+    the tracking ids open in the FingerDecomposer, in order. Type B slots
+    that are missing or unused behave as a fresh slot, as do None slots of
+    states restored from older checkpoints
+    """
+    if isinstance(mt, dtm.MultiTouchTypeBParser):
+        slots = [_fields(s) or _FRESH for s in mt.slots]
+        while slots and slots[-1] == _FRESH:
+            slots.pop()
+        attached = mt.currentSlotIndex < len(mt.slots) and \
+            mt.currentSlot is mt.slots[mt.currentSlotIndex]
+        state = (mt.currentSlotIndex, _fields(mt.currentSlot), attached, tuple(slots))
+    else:
+        state = (_fields(mt.currentSlot), tuple([_fields(e) for e in mt.listMotions]),
+                 mt.dontReport)
+    return (state, tuple(fd.tracker.keys()))
+
+
+def _continue(seamTrails, pending, trail):
+    """ The first worker's trail of a tracking id open at the seam is the
+    rest of the true trail of it, which it extends
+    """
+    trackingId = trail.tracking_id[0]
+    if trackingId not in pending:
+        return trail
+    prefix = seamTrails[trackingId]
+    for p in trail[pending.pop(trackingId):]:
+        prefix.append(p)
+    return prefix
+
+
+def _parseRange(job):
+    """ Intended for internal use only
+    Parse a byte range in a worker process from a fresh state. Returns its
+    trails, its first commands, the seam states after the reports among
+    them as (index, state, open trail lengths, trails so far), and the
+    final MT parser and FingerDecomposer states
+    """
+    (tracePath, start, end, parserType, numeric, seamEvents) = job
+    reader = dtm.MappedTraceReader(tracePath, start, end, chunkBytes=CHUNK_BYTES)
+    parser = _lineParser(numeric)
+    mt = _mtParser(parserType)
+    fd = dtm.FingerDecomposer(compactTrails=True)
+    trails = []
+    head = []
+    snapshots = []
+    for cmd in _commands(reader, parser):
+        trails.extend(_feed(mt, fd, cmd))
+        if len(head) < seamEvents:
+            head.append(cmd)
+            if _isReport(cmd):
+                lengths = tuple([len(t) for t in fd.tracker.values()])
+                snapshots.append((len(head) - 1, _seamState(mt, fd), lengths, len(trails)))
+    head = head[:snapshots[-1][0] + 1] if snapshots else []
+    return (trails, head, snapshots, mt.getState(), fd.getState())
@@ -27,33 +27,192 @@ further data. After the EOF is dispatched and processed by all stages, the
 pipeline is completed.
 """
 
+import os, sys, threading, time, bisect
+from collections import deque
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 
 class PipelineParcel:
     """ The parcel exchanged between different steps of a pipeline
+    Stages that produce nothing should return the shared PipelineParcel.EMPTY
+    instead of allocating a fresh parcel
     """
 
-    def __init__(self):
-        self.q = []
+    def __init__(self, objs=None):
+        self.q = deque()
+        if objs is not None:
+            self.q.extend(objs)
 
     def enqueue(self, obj):
         self.q.append(obj)
 
+    def enqueueMany(self, objs):
+        """ Append all objects of an iterable in order
+        """
+        self.q.extend(objs)
+
     def dequeue(self):
-        return self.q.pop(0)
+        return self.q.popleft()
+
+    def drain(self):
+        """ Remove and return all queued objects as a list, in order
+        """
+        objs = list(self.q)
+        self.q.clear()
+        return objs
 
     def isEmpty(self):
         return len(self.q) == 0
 
+    def __len__(self):
+        return len(self.q)
+
+
+class _EmptyPipelineParcel(PipelineParcel):
+    """ A read-only parcel that never holds anything, shared by all stages
+    """
+
+    def enqueue(self, obj):
+        raise TypeError("the shared empty parcel is read-only")
+
+    def enqueueMany(self, objs):
+        raise TypeError("the shared empty parcel is read-only")
+
+
+PipelineParcel.EMPTY = _EmptyPipelineParcel()
+
 
 class PipelineComponent:
     def next(self, obj):
-        return PipelineParcel()
+        return PipelineParcel.EMPTY
 
     def handleEOF(self):
         parcel = PipelineParcel()
         parcel.enqueue(Pipeline.EOF)
         return parcel
 
+    def getState(self):
+        """ Return a picklable snapshot of what the stage has to remember
+        across objects, for a pipeline checkpoint. None if nothing
+        """
+        return None
+
+    def setState(self, state):
+        """ Restore a snapshot taken by getState
+        """
+        pass
+
+    def pollTimeout(self):
+        """ The seconds until the stage has something to hand down without
+        receiving an object (see poll), None if it only reacts to objects
+        """
+        return None
+
+    def poll(self):
+        """ Produce what became due while no object arrived. A
+        ThreadedPipeline calls it once pollTimeout has elapsed
+        """
+        return PipelineParcel.EMPTY
+
+
+class MapComponent(PipelineComponent):
+    """ A stage producing exactly one output per input, e.g. a scaler.
+    Subclasses implement map() and keep the default next and handleEOF; a
+    pipeline then fuses consecutive such MapComponents into a single step
+    """
+
+    def map(self, obj):
+        return obj
+
+    def next(self, obj):
+        return PipelineParcel((self.map(obj),))
+
+
+class _FusedMapComponent(PipelineComponent):
+    """ A chain of consecutive MapComponents run as a single stage
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.maps = [stage.map for stage in stages]
+
+    def next(self, obj):
+        for m in self.maps:
+            obj = m(obj)
+        return PipelineParcel((obj,))
+
+
+class Batcher(PipelineComponent):
+    """ Group objects into lists of up to maxItems objects, handing a list
+    down once it is full or once its oldest object has waited maxLatencyMs.
+    Large batches suit offline processing, small ones (or maxItems=1) live
+    capture. In a ThreadedPipeline, a batch is handed down on time even if no
+    further object arrives (see poll). Other pipelines only run a stage when
+    an object arrives, so there the last batch before a pause waits for the
+    next object or the EOF
+    """
+
+    def __init__(self, maxItems=256, maxLatencyMs=None):
+        self.maxItems = maxItems
+        self.maxLatency = None
+        if maxLatencyMs is not None:
+            self.maxLatency = maxLatencyMs / 1000.0
+        self.batch = []
+        self.started = 0
+
+    def next(self, obj):
+        if not self.batch and self.maxLatency is not None:
+            self.started = _clock()
+        self.batch.append(obj)
+        if len(self.batch) >= self.maxItems or self.pollTimeout() == 0:
+            return self._flush()
+        return PipelineParcel.EMPTY
+
+    def pollTimeout(self):
+        if not self.batch or self.maxLatency is None:
+            return None
+        return max(0, self.started + self.maxLatency - _clock())
+
+    def poll(self):
+        if self.pollTimeout() == 0:
+            return self._flush()
+        return PipelineParcel.EMPTY
+
+    def _flush(self):
+        parcel = PipelineParcel((self.batch,))
+        self.batch = []
+        return parcel
+
+    def handleEOF(self):
+        parcel = PipelineParcel()
+        if self.batch:
+            parcel.enqueue(self.batch)
+            self.batch = []
+        parcel.enqueue(Pipeline.EOF)
+        return parcel
+
+    def getState(self):
+        return self.batch
+
+    def setState(self, state):
+        self.batch = state
+        self.started = _clock()
+
+
+class Unbatcher(PipelineComponent):
+    """ Flatten the lists made by a Batcher back into single objects
+    """
+
+    def next(self, batch):
+        return PipelineParcel(batch)
+
 
 class Pipeline:
     EOF = []  # use a dummy object as a marker
@@ -62,36 +221,921 @@ class Pipeline:
 
     def __init__(self):
         self.pl = []
+        self.stageCounts = []
+        self.instrumented = False
+        self.metrics = []
+        self.fusion = True
+        self.fusedFrom = None
+        self.checkpointPath = None
+        self.checkpointInterval = 0
+        self._steps = None
 
     def execute(self):
         """ Start the pipeline, until the first stage returns no further data
         """
+        original = self._prepare()
+        try:
+            self._run()
+        finally:
+            self._restore(original)
+
+    def _run(self):
+        """ Intended for internal use only
+        The scheduling loop behind execute
+        """
         first = self.pl[0]
+        self.stageCounts = [0] * len(self.pl)
+        checkpointing = self.checkpointPath is not None
+        if checkpointing:
+            self._nextCheckpoint = _clock() + self.checkpointInterval
         while True:
+            self.stageCounts[0] += 1
             parcel = first.next(None)
             # if the first stage returns an empty parcel, then we are 
             # almost done. Just pass down the EOF to every following stage
             if parcel.isEmpty():
-                self._executeSingleStep(1, Pipeline.EOF)
+                self._dispatch(1, PipelineParcel((Pipeline.EOF,)))
                 break
-            while not parcel.isEmpty():
-                self._executeSingleStep(1, parcel.dequeue())
+            self._dispatch(1, parcel)
+            # all stages are idle in between two pulls of the first stage
+            if checkpointing and _clock() >= self._nextCheckpoint:
+                self._checkpoint()
+        if checkpointing and os.path.exists(self.checkpointPath):
+            os.remove(self.checkpointPath)
 
     def _executeSingleStep(self, index, obj):
         """ Intended for internal use only
         index specifies which stage
         """
-        if index >= len(self.pl):
-            return None
-        if obj == Pipeline.EOF:
-            parcel = self.pl[index].handleEOF()
+        self._dispatch(index, PipelineParcel((obj,)))
+
+    def _dispatch(self, index, parcel):
+        """ Intended for internal use only
+        Feed every object of the parcel to the stage at index, depth-first.
+        An explicit stack of (stage index, pending parcel) replaces recursion
+        so that objects reach the stages in exactly the same order as if each
+        stage directly called the next one
+        """
+        pl = self.pl
+        counts = self.stageCounts
+        last = len(pl)
+        if len(counts) < last:
+            counts.extend([0] * (last - len(counts)))
+        eof = Pipeline.EOF
+        stack = [(index, parcel)]
+        while stack:
+            (index, parcel) = stack[-1]
+            if parcel.isEmpty():
+                stack.pop()
+                continue
+            obj = parcel.dequeue()
+            if index >= last:
+                continue
+            counts[index] += 1
+            if obj == eof:
+                out = pl[index].handleEOF()
+            else:
+                out = pl[index].next(obj)
+            if not out.isEmpty():
+                stack.append((index + 1, out))
+
+    def getStageCounts(self):
+        """ Return a list of (stage, number of objects it received) of the
+        last execution, EOF included. The first stage counts its pulls
+        """
+        return list(zip(self.pl, self.stageCounts))
+
+    def enableInstrumentation(self, enabled=True):
+        """ Collect StageMetrics for every stage during the next executions.
+        Without instrumentation the stages are called directly, at no cost.
+        Stages are not fused while instrumented
+        """
+        self.instrumented = enabled
+
+    def enableFusion(self, enabled=True):
+        """ Run chains of consecutive MapComponents as single steps (default)
+        """
+        self.fusion = enabled
+
+    def getMetrics(self):
+        """ Return the StageMetrics of the last instrumented execution
+        """
+        return self.metrics
+
+    def getReport(self):
+        """ Return the metrics of the last instrumented execution as a table
+        """
+        lines = [StageMetrics.HEADER]
+        for m in self.metrics:
+            lines.append(str(m))
+        return "\n".join(lines)
+
+    # the proxy wrapping each stage during an instrumented execution
+    _instrumentedStageClass = None
+
+    def _prepare(self):
+        """ Intended for internal use only
+        Swap the stages for timing proxies if instrumentation is enabled, or
+        fuse MapComponents if fusion is enabled. Return the original stages,
+        to be put back by _restore
+        """
+        original = self.pl
+        self._steps = original
+        self.fusedFrom = None
+        if self.instrumented:
+            self.metrics = [StageMetrics(stage) for stage in original]
+            self.pl = [self._instrumentedStageClass(stage, m)
+                       for (stage, m) in zip(original, self.metrics)]
+        elif self.fusion:
+            self._fuse()
+        return original
+
+    def _fuse(self):
+        """ Intended for internal use only
+        Replace every run of two or more MapComponents (past the first stage,
+        which is the source) by a _FusedMapComponent. fusedFrom records, for
+        each original stage, the index of the step that runs it
+        """
+        fused = self.pl[:1]
+        fusedFrom = [0] * min(len(self.pl), 1)
+        run = []
+        for stage in self.pl[1:] + [None]:
+            if _isFusible(stage):
+                run.append(stage)
+                continue
+            if len(run) > 1:
+                fused.append(_FusedMapComponent(run))
+                fusedFrom.extend([len(fused) - 1] * len(run))
+            else:
+                for s in run:
+                    fused.append(s)
+                    fusedFrom.append(len(fused) - 1)
+            run = []
+            if stage is not None:
+                fused.append(stage)
+                fusedFrom.append(len(fused) - 1)
+        if len(fused) < len(self.pl):
+            self.pl = fused
+            self.fusedFrom = fusedFrom
+
+    def _restore(self, original):
+        if self.fusedFrom is not None and len(self.stageCounts) == len(self.pl):
+            counts = self.stageCounts
+            self.stageCounts = [counts[i] for i in self.fusedFrom]
+            self.fusedFrom = None
+        self.pl = original
+        self._steps = None
+
+    def enableCheckpoint(self, path, interval=60.0):
+        """ While executing, save the state of every stage (see
+        PipelineComponent.getState) to path at most every interval seconds,
+        so that a crashed run can resume with resumeFromCheckpoint. The file
+        is removed once the pipeline completes. Objects a stage was handling
+        when the crash happened are processed again after resuming.
+        Only Pipeline and PipelineGraph take checkpoints, and stages that
+        hold objects in flight elsewhere (ProcessSpan, ParallelStage) cannot
+        be restored
+        """
+        self.checkpointPath = path
+        self.checkpointInterval = interval
+
+    def saveCheckpoint(self):
+        """ Write the state of every stage to the checkpoint file, atomically
+        """
+        steps = self._steps
+        if steps is None:
+            steps = self.pl
+        states = [step.getState() for step in steps]
+        tmpPath = self.checkpointPath + ".tmp"
+        fp = open(tmpPath, "wb")
+        try:
+            pickle.dump(states, fp, 2)
+        finally:
+            fp.close()
+        if hasattr(os, "replace"):
+            os.replace(tmpPath, self.checkpointPath)
         else:
-            parcel = self.pl[index].next(obj)
-        while not parcel.isEmpty():
-            nextObj = parcel.dequeue()
-            self._executeSingleStep(index + 1, nextObj)
+            if os.path.exists(self.checkpointPath):
+                os.remove(self.checkpointPath)
+            os.rename(tmpPath, self.checkpointPath)
+
+    def _checkpoint(self):
+        self.saveCheckpoint()
+        self._nextCheckpoint = _clock() + self.checkpointInterval
+
+    def resumeFromCheckpoint(self):
+        """ Restore the stages from the checkpoint file, if there is one, and
+        tell whether it did. Call it before execute, once all steps are added
+        """
+        if self.checkpointPath is None or not os.path.exists(self.checkpointPath):
+            return False
+        fp = open(self.checkpointPath, "rb")
+        try:
+            states = pickle.load(fp)
+        finally:
+            fp.close()
+        if len(states) != len(self.pl):
+            raise ValueError("checkpoint has %d stages, the pipeline %d"
+                             % (len(states), len(self.pl)))
+        for (step, state) in zip(self.pl, states):
+            step.setState(state)
+        return True
 
     def addStep(self, step):
         """ Add a step/stage to the pipeline
         """
         self.pl.append(step)
+
+
+class StageMetrics:
+    """ Metrics of one stage gathered by an instrumented pipeline: objects in
+    and out, time spent in next and handleEOF, a latency histogram of next
+    over power-of-two buckets from 1us to 8s, the largest parcel returned and,
+    for a ThreadedPipeline, the deepest its input queue got
+    """
+    BOUNDS = [0.000001 * 2 ** i for i in range(24)]
+    HEADER = "%-28s %9s %9s %10s %10s %8s %8s %8s" % ("stage", "in", "out",
+        "next(s)", "eof(s)", "mean(us)", "p99(us)", "maxout")
+
+    def __init__(self, stage):
+        self.name = stage.__class__.__name__
+        self.itemsIn = 0
+        self.itemsOut = 0
+        self.eofs = 0
+        self.nextTime = 0.0
+        self.eofTime = 0.0
+        self.maxParcel = 0
+        self.maxQueueDepth = 0
+        self.histogram = [0] * (len(StageMetrics.BOUNDS) + 1)
+
+    def recordNext(self, seconds, outCount):
+        self.itemsIn += 1
+        self.itemsOut += outCount
+        self.nextTime += seconds
+        self.histogram[bisect.bisect_right(StageMetrics.BOUNDS, seconds)] += 1
+        if outCount > self.maxParcel:
+            self.maxParcel = outCount
+
+    def recordEOF(self, seconds, outCount):
+        self.eofs += 1
+        self.itemsOut += outCount
+        self.eofTime += seconds
+        if outCount > self.maxParcel:
+            self.maxParcel = outCount
+
+    def recordQueueDepth(self, depth):
+        if depth > self.maxQueueDepth:
+            self.maxQueueDepth = depth
+
+    def percentile(self, p):
+        """ Return the upper bound (in seconds) of the histogram bucket that
+        holds the p-th percentile of the latency of next
+        """
+        total = sum(self.histogram)
+        if total == 0:
+            return 0.0
+        seen = 0
+        for (i, n) in enumerate(self.histogram):
+            seen += n
+            if seen * 100.0 >= total * p:
+                break
+        if i < len(StageMetrics.BOUNDS):
+            return StageMetrics.BOUNDS[i]
+        return float("inf")
+
+    def __str__(self):
+        mean = 0.0
+        if self.itemsIn:
+            mean = self.nextTime / self.itemsIn * 1e6
+        return "%-28s %9d %9d %10.4f %10.4f %8.1f %8.1f %8d" % (self.name,
+            self.itemsIn, self.itemsOut, self.nextTime, self.eofTime, mean,
+            self.percentile(99) * 1e6, self.maxParcel)
+
+
+# the most precise wall clock available
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class _InstrumentedStage(PipelineComponent):
+    """ A proxy timing the calls to a stage on behalf of StageMetrics
+    """
+
+    def __init__(self, stage, metrics):
+        self.stage = stage
+        self.metrics = metrics
+
+    def next(self, obj):
+        start = _clock()
+        out = self.stage.next(obj)
+        self.metrics.recordNext(_clock() - start, len(out))
+        return out
+
+    def handleEOF(self):
+        start = _clock()
+        out = self.stage.handleEOF()
+        self.metrics.recordEOF(_clock() - start, len(out))
+        return out
+
+    def pollTimeout(self):
+        return self.stage.pollTimeout()
+
+    def poll(self):
+        return self.stage.poll()
+
+
+Pipeline._instrumentedStageClass = _InstrumentedStage
+
+
+def _isFusible(stage):
+    """ Tell whether a stage is a MapComponent that a _FusedMapComponent can
+    run through map() alone, i.e. one keeping the next and handleEOF of
+    MapComponent
+    """
+    return isinstance(stage, MapComponent) and _isDefaultEOF(stage) and \
+        _function(stage.__class__.next) is _function(MapComponent.next)
+
+
+def _isDefaultEOF(stage):
+    """ Tell whether the stage keeps the EOF handling of PipelineComponent
+    """
+    return _function(stage.__class__.handleEOF) is \
+        _function(PipelineComponent.handleEOF)
+
+
+def _function(method):
+    """ The plain function behind a method, on Python 2 and 3 alike
+    """
+    return getattr(method, "__func__", getattr(method, "im_func", method))
+
+
+class PipelineGraph(Pipeline):
+    """ A pipeline shaped as a directed acyclic graph. The output of a stage
+    can be broadcast to several downstream branches and branches can merge
+    into a single stage, so a trace is read and parsed only once no matter
+    how many consumers it feeds. The first step added is the source.
+    Every object is handed depth-first to the downstream stages in the order
+    they were connected. Branches share the objects, so place stages that
+    modify objects in place (e.g. TimeScaler) on the last connected branch.
+    A stage with several upstreams gets its EOF once all of them sent one
+    """
+
+    def __init__(self):
+        Pipeline.__init__(self)
+        self.children = []
+        self.parents = []
+        self.eofCounts = []
+
+    def addStep(self, step, upstreams=None):
+        """ Add a step consuming the outputs of the given upstream steps,
+        by default of the step added right before
+        """
+        index = len(self.pl)
+        if upstreams is None:
+            upstreams = self.pl[-1:]
+        parents = [self._indexOf(u) for u in upstreams]
+        self.pl.append(step)
+        self.children.append([])
+        self.parents.append(parents)
+        self.eofCounts.append(dict([(p, 0) for p in parents]))
+        for p in parents:
+            self.children[p].append(index)
+
+    def _fuse(self):
+        # fusing would break the indices the edges refer to
+        pass
+
+    def _indexOf(self, step):
+        for (index, s) in enumerate(self.pl):
+            if s is step:
+                return index
+        raise ValueError("upstream step is not part of the graph: " + str(step))
+
+    def _run(self):
+        """ Intended for internal use only
+        Start the graph, until the source returns no further data
+        """
+        for counts in self.eofCounts:
+            for p in counts:
+                counts[p] = 0
+        first = self.pl[0]
+        self.stageCounts = [0] * len(self.pl)
+        checkpointing = self.checkpointPath is not None
+        if checkpointing:
+            self._nextCheckpoint = _clock() + self.checkpointInterval
+        while True:
+            self.stageCounts[0] += 1
+            parcel = first.next(None)
+            if parcel.isEmpty():
+                self._dispatchFrom(0, self.children[0],
+                                   PipelineParcel((Pipeline.EOF,)))
+                break
+            self._dispatchFrom(0, self.children[0], parcel)
+            if checkpointing and _clock() >= self._nextCheckpoint:
+                self._checkpoint()
+        if checkpointing and os.path.exists(self.checkpointPath):
+            os.remove(self.checkpointPath)
+
+    def _dispatch(self, index, parcel):
+        """ Intended for internal use only
+        Feed every object of the parcel to the stage at index, then on to the
+        whole subgraph below it
+        """
+        self._dispatchFrom(None, [index], parcel)
+
+    def _eofReady(self, src, dst):
+        """ Count an EOF travelling from src to dst and tell whether dst has
+        now received it from each of its upstreams
+        """
+        counts = self.eofCounts[dst]
+        before = min(counts.values())
+        counts[src] += 1
+        return min(counts.values()) > before
+
+    def _dispatchFrom(self, src, children, parcel):
+        """ Intended for internal use only
+        Broadcast every object of the parcel produced by src to the given
+        children, depth-first, with an explicit stack like Pipeline._dispatch
+        """
+        pl = self.pl
+        counts = self.stageCounts
+        if len(counts) < len(pl):
+            counts.extend([0] * (len(pl) - len(counts)))
+        eof = Pipeline.EOF
+        # each entry: [producer, its children, its parcel, current object,
+        # position of the next child to receive the current object]
+        stack = [[src, children, parcel, None, len(children)]]
+        while stack:
+            top = stack[-1]
+            (src, children, parcel, obj, k) = top
+            if k >= len(children):
+                if parcel.isEmpty():
+                    stack.pop()
+                    continue
+                obj = top[3] = parcel.dequeue()
+                k = 0
+            dst = children[k] if children else None
+            top[4] = k + 1
+            if dst is None:
+                continue
+            if obj == eof:
+                if src is not None and len(self.parents[dst]) > 1 \
+                        and not self._eofReady(src, dst):
+                    continue
+                counts[dst] += 1
+                out = pl[dst].handleEOF()
+            else:
+                counts[dst] += 1
+                out = pl[dst].next(obj)
+            if not out.isEmpty():
+                stack.append([dst, self.children[dst], out, None, len(self.children[dst])])
+
+
+class PullPipeline:
+    """ A lazy, pull-based pipeline. The source is any iterable (an open
+    file, a TextFileLineReader, a list) or a source PipelineComponent; each
+    step is either a PipelineComponent or a generator function taking the
+    upstream iterator. Iterating the pipeline yields the outputs of the last
+    step and only reads as much input as needed, e.g.
+        for trail in itertools.islice(pl, 10): ...
+    parses just enough of a trace to produce the first ten trails.
+    PipelineComponents still get their EOF through handleEOF once the
+    upstream is exhausted; generator functions simply see the end of their
+    upstream iterator
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.steps = []
+
+    def addStep(self, step):
+        """ Add a PipelineComponent or a generator function to the pipeline
+        """
+        self.steps.append(step)
+
+    def __iter__(self):
+        eof = Pipeline.EOF
+        if isinstance(self.source, PipelineComponent) and \
+                not hasattr(self.source, "__iter__"):
+            it = _pullSource(self.source)
+        else:
+            it = _iterSource(self.source)
+        for step in self.steps:
+            if isinstance(step, PipelineComponent):
+                it = iterateComponent(step, it)
+            else:
+                it = _iterGenerator(step, it)
+        for obj in it:
+            if obj is not eof:
+                yield obj
+
+
+def iterateComponent(stage, upstream):
+    """ Adapt a PipelineComponent to a generator over an upstream iterator
+    that carries Pipeline.EOF markers, as the steps of a PullPipeline do
+    """
+    eof = Pipeline.EOF
+    for obj in upstream:
+        if obj == eof:
+            parcel = stage.handleEOF()
+        else:
+            parcel = stage.next(obj)
+        while not parcel.isEmpty():
+            yield parcel.dequeue()
+
+
+def _iterSource(iterable):
+    for obj in iterable:
+        yield obj
+    yield Pipeline.EOF
+
+
+def _pullSource(stage):
+    while True:
+        parcel = stage.next(None)
+        if parcel.isEmpty():
+            break
+        while not parcel.isEmpty():
+            yield parcel.dequeue()
+    yield Pipeline.EOF
+
+
+def _iterGenerator(func, upstream):
+    eof = Pipeline.EOF
+    for obj in func(_withoutEOF(upstream)):
+        yield obj
+    yield eof
+
+
+def _withoutEOF(upstream):
+    eof = Pipeline.EOF
+    for obj in upstream:
+        if obj is not eof:
+            yield obj
+
+
+class ThreadedPipeline(Pipeline):
+    """ A pipeline that runs every stage on its own thread. Adjacent stages
+    are connected by bounded queues, so the I/O of one stage (e.g. reading a
+    trace, talking to a device) overlaps with the work of the others. A full
+    queue blocks its producer, which keeps a fast reader from running ahead
+    of slow stages with unbounded memory. A stage waiting for objects is
+    polled once its pollTimeout elapses, so that e.g. a Batcher behind a live
+    reader hands its batch down during a pause.
+    Every stage sees exactly the same sequence of objects (EOF included) as
+    with Pipeline, only the interleaving between stages differs. Hence a stage
+    must not modify an object once it has been handed downstream
+    """
+
+    def __init__(self, capacity=64):
+        """ capacity is the number of parcels each inter-stage queue holds
+        """
+        Pipeline.__init__(self)
+        self.capacity = capacity
+
+    def _run(self):
+        """ Intended for internal use only
+        Start all stages and wait until the EOF went through all of them.
+        The first exception raised by a stage is re-raised here
+        """
+        self.stageCounts = [0] * len(self.pl)
+        self._error = None
+        queues = [None]
+        for _ in range(1, len(self.pl)):
+            queues.append(Queue.Queue(self.capacity))
+        queues.append(None)
+        threads = [threading.Thread(target=self._runSource,
+                                    args=(queues[1],))]
+        for index in range(1, len(self.pl)):
+            threads.append(threading.Thread(target=self._runStage,
+                args=(index, queues[index], queues[index + 1])))
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        if self._error is not None:
+            raise self._error
+
+    def _fail(self, e):
+        if self._error is None:
+            self._error = e
+
+    def _runSource(self, outq):
+        """ Intended for internal use only
+        Pull the first stage until it returns an empty parcel
+        """
+        first = self.pl[0]
+        try:
+            while self._error is None:
+                self.stageCounts[0] += 1
+                parcel = first.next(None)
+                if parcel.isEmpty():
+                    if outq is not None:
+                        outq.put([Pipeline.EOF])
+                    break
+                objs = parcel.drain()
+                if outq is not None:
+                    outq.put(objs)
+        except Exception:
+            self._fail(sys.exc_info()[1])
+        if outq is not None:
+            outq.put(_END_OF_STREAM)
+
+    def _runStage(self, index, inq, outq):
+        """ Intended for internal use only
+        Feed the stage at index with everything from inq and forward its
+        outputs to outq, until the upstream stage finishes
+        """
+        stage = self.pl[index]
+        counts = self.stageCounts
+        eof = Pipeline.EOF
+        failed = False
+        metrics = None
+        if self.instrumented:
+            metrics = self.metrics[index]
+        while True:
+            if metrics is not None:
+                metrics.recordQueueDepth(inq.qsize())
+            timeout = None
+            if not failed:
+                timeout = stage.pollTimeout()
+            if timeout is None:
+                objs = inq.get()
+            else:
+                try:
+                    objs = inq.get(True, timeout)
+                except Queue.Empty:
+                    # nothing arrived in time, let the stage hand down
+                    # what became due meanwhile (e.g. a late batch)
+                    objs = ()
+            if objs is _END_OF_STREAM:
+                break
+            if failed:
+                # keep draining so that upstream never blocks on us
+                continue
+            try:
+                if not objs:
+                    out = stage.poll()
+                    if not out.isEmpty() and outq is not None:
+                        outq.put(out.drain())
+                for obj in objs:
+                    counts[index] += 1
+                    if obj == eof:
+                        out = stage.handleEOF()
+                    else:
+                        out = stage.next(obj)
+                    if not out.isEmpty():
+                        out = out.drain()
+                        if outq is not None:
+                            outq.put(out)
+            except Exception:
+                self._fail(sys.exc_info()[1])
+                failed = True
+        if outq is not None:
+            outq.put(_END_OF_STREAM)
+
+
+# marks the end of the stream between two threads of a ThreadedPipeline
+_END_OF_STREAM = object()
+
+
+class ProcessSpan(PipelineComponent):
+    """ Run a span of consecutive stages in a separate worker process, e.g.
+    the CPU-bound RawTraceParser -> MultiTouchTypeBParser -> FingerDecomposer
+    of a large trace, while the parent process keeps driving the rest.
+    Objects cross the process boundary in pickled chunks of chunkSize, so the
+    stages and everything they exchange must be picklable; what is not fails
+    the span with a RuntimeError. The span emits the same sequence of
+    objects as the stages would inline, only later.
+    The worker owns the stages until an EOF has gone through them; the
+    parent's stage objects are then replaced by their final state. Requires
+    the multiprocessing module, which is not available on monkeyrunner
+    """
+
+    # how often a blocked parent checks that the worker is still alive
+    POLL_SECONDS = 0.5
+
+    def __init__(self, stages, chunkSize=512, capacity=8):
+        """ capacity is the number of chunks that may be in flight towards
+        the worker before next() blocks
+        """
+        self.stages = list(stages)
+        self.chunkSize = chunkSize
+        self.capacity = capacity
+        self.pending = []
+        self.worker = None
+
+    def next(self, obj):
+        self.pending.append(obj)
+        if len(self.pending) < self.chunkSize:
+            return PipelineParcel.EMPTY
+        self._flush()
+        return self._collect(False)
+
+    def handleEOF(self):
+        self.pending.append(Pipeline.EOF)
+        self._flush()
+        self._put(None)
+        parcel = self._collect(True)
+        self.worker.join()
+        self.worker = None
+        return parcel
+
+    def _flush(self):
+        if self.worker is None:
+            import multiprocessing
+            self.inq = multiprocessing.Queue(self.capacity)
+            self.outq = multiprocessing.Queue()
+            self.worker = multiprocessing.Process(target=_runProcessSpan,
+                args=(self.stages, self.inq, self.outq))
+            self.worker.daemon = True
+            self.worker.start()
+        # pickled here, so that a failure is raised here rather than lost in
+        # the feeder thread of the queue
+        self._put(pickle.dumps(self.pending, 2))
+        self.pending = []
+
+    def _put(self, chunk):
+        while True:
+            try:
+                self.inq.put(chunk, True, ProcessSpan.POLL_SECONDS)
+                return
+            except Queue.Full:
+                self._checkWorker()
+
+    def _checkWorker(self):
+        """ Fail if the worker has exited without a word
+        """
+        if self.worker.exitcode is not None:
+            code = self.worker.exitcode
+            self.worker.join()
+            self.worker = None
+            raise RuntimeError("ProcessSpan worker exited with code %d" % code)
+
+    def _collect(self, untilDone):
+        """ Gather the outputs the worker has produced so far. With untilDone,
+        wait for the worker to finish and take over its stages
+        """
+        parcel = PipelineParcel()
+        exited = False
+        while True:
+            try:
+                if untilDone:
+                    (kind, payload) = self.outq.get(True, ProcessSpan.POLL_SECONDS)
+                else:
+                    (kind, payload) = self.outq.get(False)
+            except Queue.Empty:
+                if not untilDone:
+                    return parcel
+                # what a worker sends is flushed before it exits, give the
+                # queue one more poll once it has
+                if exited:
+                    self._checkWorker()
+                exited = self.worker.exitcode is not None
+                continue
+            if kind == "out":
+                parcel.enqueueMany(pickle.loads(payload))
+            elif kind == "done":
+                self.stages = pickle.loads(payload)
+                return parcel
+            else:
+                self.worker.join()
+                self.worker = None
+                raise RuntimeError("ProcessSpan worker failed:\n" + payload)
+
+
+class _Collector(PipelineComponent):
+    def __init__(self):
+        self.objs = []
+
+    def next(self, obj):
+        self.objs.append(obj)
+        return PipelineParcel.EMPTY
+
+    def handleEOF(self):
+        self.objs.append(Pipeline.EOF)
+        return PipelineParcel.EMPTY
+
+
+def _runProcessSpan(stages, inq, outq):
+    """ Intended for internal use only
+    The worker process of a ProcessSpan. It reports ("out", objs) per chunk,
+    then ("done", stages) once the parent stops sending, both pickled, or
+    ("error", msg)
+    """
+    import traceback
+    pl = Pipeline()
+    for stage in stages:
+        pl.addStep(stage)
+    collector = _Collector()
+    pl.addStep(collector)
+    try:
+        while True:
+            chunk = inq.get()
+            if chunk is None:
+                break
+            pl._dispatch(0, PipelineParcel(pickle.loads(chunk)))
+            if collector.objs:
+                # pickled here, so that a failure is reported as an error
+                outq.put(("out", pickle.dumps(collector.objs, 2)))
+                collector.objs = []
+        outq.put(("done", pickle.dumps(stages, 2)))
+    except Exception:
+        outq.put(("error", traceback.format_exc()))
+
+
+class ParallelStage(PipelineComponent):
+    """ Run a stateless stage (e.g. RawTraceParser, TrailScaler) on a pool of
+    worker threads or processes while keeping its outputs in input order.
+    Inputs are grouped into chunks of chunkSize; at most window chunks are
+    in flight, finished chunks wait there until all earlier ones are done.
+    The stage must not keep state between objects: each worker runs its own
+    copy (processes) or they share it concurrently (threads). Its handleEOF
+    runs in the pipeline once all earlier objects have been emitted.
+    Requires the multiprocessing module, which is not available on
+    monkeyrunner
+    """
+
+    def __init__(self, stage, workers=4, processes=False, chunkSize=256, window=None):
+        self.stage = stage
+        self.workers = workers
+        self.processes = processes
+        self.chunkSize = chunkSize
+        self.window = window
+        if window is None:
+            self.window = 2 * workers
+        self.pending = []
+        self.inflight = deque()
+        self.pool = None
+
+    def next(self, obj):
+        self.pending.append(obj)
+        if len(self.pending) < self.chunkSize:
+            return PipelineParcel.EMPTY
+        self._submit()
+        parcel = PipelineParcel()
+        # emit the chunks finished so far, in order, and block on the oldest
+        # one only if the reorder window is full
+        while self.inflight and (self.inflight[0].ready() or
+                                 len(self.inflight) >= self.window):
+            self._emitOldest(parcel)
+        return parcel
+
+    def handleEOF(self):
+        if self.pending:
+            self._submit()
+        parcel = PipelineParcel()
+        while self.inflight:
+            self._emitOldest(parcel)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        parcel.enqueueMany(self.stage.handleEOF().drain())
+        return parcel
+
+    def _submit(self):
+        if self.pool is None:
+            if self.processes:
+                import multiprocessing
+                self.pool = multiprocessing.Pool(self.workers,
+                    _initParallelWorker, (self.stage,))
+            else:
+                from multiprocessing.pool import ThreadPool
+                self.pool = ThreadPool(self.workers)
+        if self.processes:
+            result = self.pool.apply_async(_runParallelChunk, (None, self.pending))
+        else:
+            result = self.pool.apply_async(_runParallelChunk, (self.stage, self.pending))
+        self.inflight.append(result)
+        self.pending = []
+
+    def _emitOldest(self, parcel):
+        for objs in self.inflight.popleft().get():
+            parcel.enqueueMany(objs)
+
+
+# the copy of the stage a ParallelStage worker process runs
+_parallelWorkerStage = None
+
+
+def _initParallelWorker(stage):
+    global _parallelWorkerStage
+    _parallelWorkerStage = stage
+
+
+def _runParallelChunk(stage, chunk):
+    """ Intended for internal use only
+    Run the stage over a chunk, returning the outputs of every object. A
+    worker process passes no stage and uses its own copy instead
+    """
+    if stage is None:
+        stage = _parallelWorkerStage
+    eof = Pipeline.EOF
+    outs = []
+    for obj in chunk:
+        if obj == eof:
+            outs.append(stage.handleEOF().drain())
+        else:
+            outs.append(stage.next(obj).drain())
+    return outs
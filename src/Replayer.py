@@ -31,11 +31,15 @@ class Replayer(PipelineComponent):
         """ Process the replay event and return a parcel like other
         pipeline components
         """
-        return PipelineParcel()
+        return PipelineParcel.EMPTY
     def getTimestamp(self):
         return self.timestamp
     def setTimestamp(self, timestamp):
         self.timestamp = timestamp
+    def getState(self):
+        return self.timestamp
+    def setState(self, timestamp):
+        self.timestamp = timestamp
 
 class CompositeReplayer(Replayer):
     def __init__(self, replayers):
@@ -61,14 +65,17 @@ class CompositeReplayer(Replayer):
         # all containing replayers
         mypp = PipelineParcel()
         for r in self.replayers:
-            pp = r.handleEOF()
-            while not pp.isEmpty():
-                obj = pp.dequeue()
+            for obj in r.handleEOF().drain():
                 if obj != Pipeline.EOF:
                     mypp.enqueue(obj)
         if mypp.isEmpty():
             mypp.enqueue(Pipeline.EOF)
         return mypp
+    def getState(self):
+        return [r.getState() for r in self.replayers]
+    def setState(self, states):
+        for (r, state) in zip(self.replayers, states):
+            r.setState(state)
 
 class ReplayEvent:
     def __init__(self, timestamp):
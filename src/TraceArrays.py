@@ -0,0 +1,254 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This module loads a whole `getevent -lt` trace into a NumPy structured array
+(see EVENT_DTYPE) for vectorized analysis, e.g.
+    events = loadTrace("trace.txt")
+    xs = events[events["code"] == EventCodes.CODES[EventCodes.EV_ABS]["ABS_MT_POSITION_X"]]
+The text is tokenized with array operations over its bytes, so no Python
+object is created per line. Event types and codes are the kernel numbers
+from EventCodes. It requires NumPy, hence it lives apart from
+TraceManipulation, which must remain importable by monkeyrunner.
+"""
+
+import re
+import numpy
+import EventCodes
+
+EVENT_DTYPE = numpy.dtype([("timestamp", numpy.float64), ("type", numpy.uint16),
+                           ("code", numpy.uint16), ("value", numpy.int64)])
+
+# a record of BinaryTrace
+_RECORD_DTYPE = numpy.dtype([("timestamp", "<i8"), ("type", "<u2"), ("code", "<u2"),
+                             ("value", "<u4")])
+
+# the file is parsed in blocks of about this size to bound the memory used
+CHUNK_BYTES = 16 << 20
+
+_WORD = re.compile(r"\w+$")
+
+
+def _table(chars):
+    t = numpy.zeros(256, dtype=bool)
+    t[numpy.frombuffer(chars, dtype=numpy.uint8)] = True
+    return t
+
+# bytes that separate the tokens of a line; the brackets around the
+# timestamp are checked separately
+_SEPARATORS = _table(b" \t\r\n\x0b\x0c[]")
+_BLANKS = _table(b" \t\r\x0b\x0c")
+_TIMESTAMP_CHARS = _table(b"0123456789.\x00")
+_HEX_DIGITS = numpy.full(256, -1, dtype=numpy.int64)
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _HEX_DIGITS[_c] = _i
+for _i, _c in enumerate(b"ABCDEF"):
+    _HEX_DIGITS[_c] = 10 + _i
+_HEX_DIGITS[0] = 0
+_NEWLINE = ord("\n")
+
+
+def loadTrace(path, chunkBytes=CHUNK_BYTES):
+    """ Read a whole `getevent -lt` file into an array of EVENT_DTYPE.
+    Blank lines are skipped; a malformed line raises ValueError
+    """
+    fp = open(path, "rb")
+    try:
+        chunks = []
+        rest = b""
+        lineNo = 1
+        while True:
+            block = fp.read(chunkBytes)
+            if not block:
+                break
+            block = rest + block
+            cut = block.rfind(b"\n") + 1
+            if cut == 0:
+                rest = block
+                continue
+            chunks.append(parseTrace(block[:cut], lineNo))
+            lineNo += block.count(b"\n", 0, cut)
+            rest = block[cut:]
+        if rest:
+            chunks.append(parseTrace(rest, lineNo))
+    finally:
+        fp.close()
+    if not chunks:
+        return numpy.zeros(0, dtype=EVENT_DTYPE)
+    return numpy.concatenate(chunks)
+
+
+def parseTrace(text, firstLine=1):
+    """ Parse `getevent -lt` text (bytes, or a buffer such as the views of a
+    MappedTraceReader) into an array of EVENT_DTYPE.
+    firstLine numbers the lines in error messages
+    """
+    data = numpy.frombuffer(text, dtype=numpy.uint8)
+    if len(data) == 0:
+        return numpy.zeros(0, dtype=EVENT_DTYPE)
+    newlines = numpy.flatnonzero(data == _NEWLINE)
+    inToken = (~_SEPARATORS[data]).view(numpy.int8)
+    edges = numpy.diff(inToken, prepend=0, append=0)
+    starts = numpy.flatnonzero(edges == 1)
+    ends = numpy.flatnonzero(edges == -1)
+    # every non-blank line holds [timestamp] type code value
+    lineOfToken = numpy.searchsorted(newlines, starts)
+    tokensPerLine = numpy.bincount(lineOfToken, minlength=len(newlines) + 1)
+    bad = numpy.flatnonzero((tokensPerLine != 0) & (tokensPerLine != 4))
+    if len(bad):
+        _malformed(text, newlines, bad[0], firstLine)
+    starts = starts.reshape(-1, 4)
+    ends = ends.reshape(-1, 4)
+    lines = lineOfToken[::4]
+    _checkBrackets(text, data, newlines, starts[:, 0], ends[:, 0], lines, firstLine)
+    events = numpy.zeros(len(starts), dtype=EVENT_DTYPE)
+    events["timestamp"] = _parseTimestamps(text, data, newlines, starts[:, 0], ends[:, 0],
+                                           lines, firstLine)
+    events["type"] = _parseNames(text, data, newlines, starts[:, 1], ends[:, 1], lines,
+                                 firstLine, EventCodes.typeNumber)
+    events["code"] = _parseNames(text, data, newlines, starts[:, 2], ends[:, 2], lines,
+                                 firstLine, EventCodes.codeNumber)
+    events["value"] = _parseValues(text, data, newlines, starts[:, 3], ends[:, 3], lines,
+                                   firstLine)
+    return events
+
+
+def _checkBrackets(text, data, newlines, starts, ends, lines, firstLine):
+    """ The timestamp must be preceded by "[" (and blanks) at the beginning
+    of its line and immediately followed by "]", and a line holds no other
+    bracket
+    """
+    ok = (ends < len(data)) & (data[numpy.minimum(ends, len(data) - 1)] == ord("]"))
+    # the last byte before the timestamp that is not blank
+    visible = numpy.flatnonzero(~_BLANKS[data])
+    before = numpy.searchsorted(visible, starts) - 1
+    opening = visible[numpy.maximum(before, 0)]
+    ok &= (before >= 0) & (data[opening] == ord("["))
+    # and what precedes the "[" is the beginning of the line
+    lineStarts = numpy.concatenate(([0], newlines + 1))[lines]
+    ok &= opening == lineStarts
+    brackets = numpy.flatnonzero((data == ord("[")) | (data == ord("]")))
+    perLine = numpy.bincount(numpy.searchsorted(newlines, brackets),
+                             minlength=len(newlines) + 1)
+    ok &= perLine[lines] == 2
+    _raiseUnless(ok, text, newlines, lines, firstLine)
+
+
+def _parseTimestamps(text, data, newlines, starts, ends, lines, firstLine):
+    chars = _gather(data, starts, ends, False)
+    dots = (chars == ord(".")).sum(axis=1)
+    first = chars[:, 0]
+    last = chars[numpy.arange(len(chars)), ends - starts - 1]
+    ok = _TIMESTAMP_CHARS[chars].all(axis=1) & (dots == 1) & \
+        (first != ord(".")) & (last != ord("."))
+    _raiseUnless(ok, text, newlines, lines, firstLine)
+    return _asStrings(chars).astype(numpy.float64)
+
+
+def _parseNames(text, data, newlines, starts, ends, lines, firstLine, number):
+    """ Map the labels to their numbers; only distinct labels are looked at
+    one by one
+    """
+    names = _asStrings(_gather(data, starts, ends, False))
+    (distinct, inverse) = numpy.unique(names, return_inverse=True)
+    numbers = numpy.zeros(len(distinct), dtype=numpy.uint16)
+    for i in range(len(distinct)):
+        name = distinct[i].decode("latin-1")
+        if _WORD.match(name) is None:
+            _raiseUnless(inverse.reshape(-1) != i, text, newlines, lines, firstLine)
+        numbers[i] = number(name)
+    return numbers[inverse.reshape(-1)]
+
+
+def _parseValues(text, data, newlines, starts, ends, lines, firstLine):
+    """ Values are hex, except that BTN_TOUCH may print DOWN or UP
+    """
+    if len(starts) and (ends - starts).max() > 15:
+        _raiseUnless(ends - starts <= 15, text, newlines, lines, firstLine)
+    chars = _gather(data, starts, ends, True)
+    digits = _HEX_DIGITS[chars]
+    isHex = (digits >= 0).all(axis=1)
+    weights = 16 ** numpy.arange(chars.shape[1] - 1, -1, -1, dtype=numpy.int64)
+    values = (numpy.maximum(digits, 0) * weights).sum(axis=1)
+    if not isHex.all():
+        words = _asStrings(_gather(data, starts, ends, False))
+        down = words == b"DOWN"
+        up = words == b"UP"
+        _raiseUnless(isHex | down | up, text, newlines, lines, firstLine)
+        values[down] = 1
+        values[up] = 0
+    return values
+
+
+def _gather(data, starts, ends, right):
+    """ Copy tokens into the rows of a zero padded byte matrix, aligned to
+    the left or, for numbers, to the right
+    """
+    width = max(int((ends - starts).max()) if len(starts) else 1, 1)
+    columns = numpy.arange(width)
+    if right:
+        index = ends[:, None] - width + columns
+        valid = index >= starts[:, None]
+    else:
+        index = starts[:, None] + columns
+        valid = index < ends[:, None]
+    index = numpy.clip(index, 0, len(data) - 1)
+    return numpy.where(valid, data[index], 0).astype(numpy.uint8)
+
+
+def _asStrings(chars):
+    return numpy.ascontiguousarray(chars).view("S%d" % chars.shape[1]).reshape(-1)
+
+
+def _raiseUnless(ok, text, newlines, lines, firstLine):
+    bad = numpy.flatnonzero(~ok)
+    if len(bad):
+        _malformed(text, newlines, lines[bad[0]], firstLine)
+
+
+def _malformed(text, newlines, line, firstLine):
+    begin = 0
+    if line > 0:
+        begin = newlines[line - 1] + 1
+    end = len(text)
+    if line < len(newlines):
+        end = newlines[line]
+    raise ValueError("line %d: unidentified raw trace line: %r" % (
+        firstLine + line, bytes(text[begin:end]).decode("latin-1")))
+
+
+def loadBinaryTrace(path):
+    """ Read the records of a binary trace (see BinaryTrace) into an array of
+    EVENT_DTYPE. Types and codes BinaryTrace gave numbers of its own keep
+    them, see the header's typeName/codeName
+    """
+    import BinaryTrace
+    fp = open(path, "rb")
+    try:
+        header = BinaryTrace.BinaryTraceHeader(fp)
+        data = fp.read(header.labelsOffset - header.recordsOffset)
+    finally:
+        fp.close()
+    records = numpy.frombuffer(data, dtype=_RECORD_DTYPE)
+    events = numpy.empty(len(records), dtype=EVENT_DTYPE)
+    events["timestamp"] = records["timestamp"] / 1e6
+    events["type"] = records["type"]
+    events["code"] = records["code"]
+    events["value"] = records["value"]
+    return events
@@ -22,19 +22,26 @@ This module provides several components that can manipulate the trace
 collected from Android devices. 
 """
 
-import re, sys
-from Pipeline import PipelineParcel, PipelineComponent, Pipeline
+import os, re, sys, threading, bisect, array
+from Pipeline import PipelineParcel, PipelineComponent, MapComponent, Pipeline
+import EventCodes
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 
 
-class MotionEvent:
+class MotionEvent(object):
     """ This data structure describes a single evdev report
     """
-    timestamp = 0
-    tracking_id = 0xFFFFFFFF
-    touch_major = 0
-    x = 0
-    y = 0
-    pressure = 0
+    __slots__ = ("timestamp", "tracking_id", "touch_major", "x", "y", "pressure")
+    DEFAULTS = {"timestamp": 0, "tracking_id": 0xFFFFFFFF, "touch_major": 0,
+                "x": 0, "y": 0, "pressure": 0}
+
+    def __getattr__(self, name):
+        """ Only called for attributes not set yet, which have their defaults
+        """
+        return _default(self, name)
 
     def __str__(self):
         return str((self.timestamp, self.tracking_id, self.touch_major, self.x, self.y, self.pressure))
@@ -52,141 +59,381 @@ class MotionEvent:
         s.pressure = self.pressure
         return s
 
+    def __getstate__(self):
+        return (self.timestamp, self.tracking_id, self.touch_major, self.x, self.y, self.pressure)
+
+    def __setstate__(self, state):
+        (self.timestamp, self.tracking_id, self.touch_major, self.x, self.y, self.pressure) = state
+
 
-class GeteventCommand:
+class GeteventCommand(object):
     """ This data structure describes a single command from Android getevent utility
     """
-    timestamp = 0
-    evType = ""
-    evCmd = ""
-    evVal = 0
+    __slots__ = ("timestamp", "evType", "evCmd", "evVal")
+    DEFAULTS = {"timestamp": 0, "evType": "", "evCmd": "", "evVal": 0}
+
+    def __getattr__(self, name):
+        """ Only called for attributes not set yet, which have their defaults
+        """
+        return _default(self, name)
 
     def __str__(self):
         return str((self.timestamp, self.evType, self.evCmd, self.evVal))
 
+    def __getstate__(self):
+        return (self.timestamp, self.evType, self.evCmd, self.evVal)
+
+    def __setstate__(self, state):
+        (self.timestamp, self.evType, self.evCmd, self.evVal) = state
+
+
+def _default(obj, name):
+    try:
+        return obj.DEFAULTS[name]
+    except KeyError:
+        raise AttributeError(name)
+
+
+class Trail(object):
+    """ A finger trail stored column by column: every MotionEvent attribute
+    is an array (e.g. trail.x), which takes a fraction of the memory of one
+    object per motion event. Indexing and iterating give TrailPoints, which
+    read and write the columns with the attributes of a MotionEvent, so a
+    Trail can be used in place of a list of motion events. A column turns
+    into a plain list if it is given values its array cannot hold
+    """
+    __slots__ = ("timestamp", "tracking_id", "touch_major", "x", "y", "pressure")
+    TYPECODES = (("timestamp", "d"), ("tracking_id", "l"), ("touch_major", "i"),
+                 ("x", "i"), ("y", "i"), ("pressure", "i"))
+
+    def __init__(self, motionEvents=()):
+        for (name, typecode) in Trail.TYPECODES:
+            setattr(self, name, array.array(typecode))
+        for e in motionEvents:
+            self.append(e)
+
+    def append(self, e):
+        for name in Trail.__slots__:
+            self.store(name, None, getattr(e, name))
+
+    def store(self, name, index, value):
+        """ Set (or append, if index is None) a value of a column
+        """
+        column = getattr(self, name)
+        try:
+            if index is None:
+                column.append(value)
+            else:
+                column[index] = value
+        except (TypeError, OverflowError):
+            column = list(column)
+            setattr(self, name, column)
+            self.store(name, index, value)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TrailPoint(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("trail index out of range")
+        return TrailPoint(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TrailPoint(self, i)
+
+    def __str__(self):
+        return str(list(self))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in Trail.__slots__]
+
+    def __setstate__(self, state):
+        for (name, column) in zip(Trail.__slots__, state):
+            setattr(self, name, column)
+
+
+class TrailPoint(object):
+    """ A motion event of a Trail, as a view of its columns
+    """
+    __slots__ = ("trail", "index")
+
+    def __init__(self, trail, index):
+        self.trail = trail
+        self.index = index
+
+    def __str__(self):
+        return str(tuple([getattr(self.trail, name)[self.index] for name in Trail.__slots__]))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def clone(self):
+        s = MotionEvent()
+        for name in Trail.__slots__:
+            setattr(s, name, getattr(self.trail, name)[self.index])
+        return s
+
+
+def _column(name):
+    return property(lambda self: getattr(self.trail, name)[self.index],
+                    lambda self, value: self.trail.store(name, self.index, value))
+
+for _name in Trail.__slots__:
+    setattr(TrailPoint, _name, _column(_name))
+
 
 # the doc for the MT protocol can be found here:
 # https://www.kernel.org/doc/Documentation/input/multi-touch-protocol.txt
 
-class MultiTouchTypeAParser(PipelineComponent):
+class EventDispatcher(PipelineComponent):
+    """ The base of the parsers that act on getevent commands by type and code.
+    HANDLERS maps (type, code) numbers from EventCodes to the name of a
+    method taking the command and returning a parcel, or None when it
+    produces nothing; a code of None stands for the other codes of a type.
+    Labels are interned to their numbers the first time they are met, so
+    each command costs one lookup. Commands with no handler are counted and
+    reported once, at EOF
+    """
+    HANDLERS = {}
+    LABEL = "MT"
+
+    def __init__(self):
+        self.dispatch = {}
+        self.unknownCounts = {}
+
+    def next(self, geteventCmd):
+        """ Take a stream of getevent commands and produce motion events
+        """
+        try:
+            handler = self.dispatch[geteventCmd.evType][geteventCmd.evCmd]
+        except KeyError:
+            handler = self.intern(geteventCmd.evType, geteventCmd.evCmd)
+        return handler(geteventCmd) or PipelineParcel.EMPTY
+
+    def intern(self, typeLabel, cmdLabel):
+        """ Find the handler of a pair of labels, or of numbers as the
+        commands of a numeric trace carry
+        """
+        (evType, evCmd) = (typeLabel, cmdLabel)
+        if isinstance(evType, str):
+            evType = EventCodes.typeNumber(evType)
+            evCmd = EventCodes.codeNumber(evCmd, evType)
+        name = self.HANDLERS.get((evType, evCmd))
+        if name is None:
+            name = self.HANDLERS.get((evType, None), "unknown")
+        handler = getattr(self, name)
+        self.dispatch.setdefault(typeLabel, {})[cmdLabel] = handler
+        return handler
+
+    def __getstate__(self):
+        # the interned handlers are bound methods, which Python 2 cannot
+        # pickle (e.g. for a ProcessSpan); they are interned again
+        state = self.__dict__.copy()
+        state["dispatch"] = {}
+        return state
+
+    def unknown(self, geteventCmd):
+        key = (geteventCmd.evType, geteventCmd.evCmd)
+        self.unknownCounts[key] = self.unknownCounts.get(key, 0) + 1
+
+    def handleEOF(self):
+        if self.unknownCounts:
+            counts = ["%s %s x%d" % (_label(evType, evCmd) + (n,)) for ((evType, evCmd), n)
+                      in self.unknownCounts.items()]
+            counts.sort()
+            print("[WARN] %s ignored %d events: %s" % (
+                self.LABEL, sum(self.unknownCounts.values()), ", ".join(counts)))
+            self.unknownCounts = {}
+        return PipelineComponent.handleEOF(self)
+
+
+def _label(evType, evCmd):
+    """ The labels of a type and code, which may be numbers
+    """
+    if isinstance(evType, str):
+        return (evType, evCmd)
+    return (EventCodes.typeName(evType), EventCodes.codeName(evType, evCmd))
+
+
+_ABS = EventCodes.CODES[EventCodes.EV_ABS]
+_SYN = EventCodes.CODES[EventCodes.EV_SYN]
+
+
+class MultiTouchTypeAParser(EventDispatcher):
     """ A type-A multi-touch evdev device
     """
     NAVIGATION_HEIGHT = 48  # the height of the standard navigation bar at the bottom, in pixels
+    LABEL = "TypeA MT"
+    HANDLERS = {
+        (EventCodes.EV_ABS, _ABS["ABS_MT_POSITION_X"]): "setX",
+        (EventCodes.EV_ABS, _ABS["ABS_X"]): "setX",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_POSITION_Y"]): "setY",
+        (EventCodes.EV_ABS, _ABS["ABS_Y"]): "setY",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_TRACKING_ID"]): "setTrackingId",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_PRESSURE"]): "setPressure",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_TOUCH_MAJOR"]): "setTouchMajor",
+        (EventCodes.EV_ABS, _ABS["ABS_MISC"]): "skipReport",
+        (EventCodes.EV_ABS, None): "unknownAbs",
+        (EventCodes.EV_SYN, _SYN["SYN_REPORT"]): "report",
+        (EventCodes.EV_SYN, _SYN["SYN_MT_REPORT"]): "mtReport",
+    }
 
     def __init__(self):
+        EventDispatcher.__init__(self)
         self.currentSlot = MotionEvent()
         self.listMotions = []
         self.dontReport = False  # one-shot disabler
 
-    def next(self, geteventCmd):
-        """ Take a stream of getevent commands and produce motion events
+    def slot(self):
+        """ The slot being reported, started by any EV_ABS command
         """
-        parcel = PipelineParcel()
-        if geteventCmd.evType == "EV_ABS":
-            if self.currentSlot is None:
-                self.currentSlot = MotionEvent()
-            if geteventCmd.evCmd == "ABS_MT_POSITION_X" or geteventCmd.evCmd == "ABS_X":
-                self.currentSlot.x = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_POSITION_Y" or geteventCmd.evCmd == "ABS_Y":
-                self.currentSlot.y = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_TRACKING_ID":
-                if geteventCmd.evVal == 0xFFFFFFFF:
-                    self.currentSlot = None
-                else:
-                    self.currentSlot.tracking_id = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_PRESSURE":
-                self.currentSlot.pressure = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_TOUCH_MAJOR":
-                self.currentSlot.touch_major = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MISC":
-                self.dontReport = True
-            else:
-                print("[WARN] Type A MT meets unknown evCmd" + str(geteventCmd))
-        elif geteventCmd.evType == "EV_KEY":
-            if geteventCmd.evCmd == "BTN_TOUCH":
-                print("[WARN] TypeA MT ignores BTN_TOUCH")
-            else:
-                print("[WARN] TypeA MT meets unknown evCmd" + str(geteventCmd))
-        elif geteventCmd.evType == "EV_SYN":
-            if geteventCmd.evCmd == "SYN_REPORT":
-                if self.currentSlot is not None:
-                    self.currentSlot.timestamp = geteventCmd.timestamp
-                    self.listMotions.append(self.currentSlot)
-                    self.currentSlot = self.currentSlot.clone()
-                if self.dontReport:
-                    self.dontReport = False
-                else:
-                    parcel.enqueue(self.listMotions)
-                self.listMotions = []
-            elif geteventCmd.evCmd == "SYN_MT_REPORT":
-                if self.currentSlot is not None:
-                    self.currentSlot.timestamp = geteventCmd.timestamp
-                    self.listMotions.append(self.currentSlot)
-                    self.currentSlot = None
-            else:
-                print("[WARN] TypeA MT meets unknown evCmd" + str(geteventCmd))
+        if self.currentSlot is None:
+            self.currentSlot = MotionEvent()
+        return self.currentSlot
+
+    def setX(self, geteventCmd):
+        (self.currentSlot or self.slot()).x = geteventCmd.evVal
+
+    def setY(self, geteventCmd):
+        (self.currentSlot or self.slot()).y = geteventCmd.evVal
+
+    def setTrackingId(self, geteventCmd):
+        if geteventCmd.evVal == 0xFFFFFFFF:
+            self.currentSlot = None
+        else:
+            (self.currentSlot or self.slot()).tracking_id = geteventCmd.evVal
+
+    def setPressure(self, geteventCmd):
+        (self.currentSlot or self.slot()).pressure = geteventCmd.evVal
+
+    def setTouchMajor(self, geteventCmd):
+        (self.currentSlot or self.slot()).touch_major = geteventCmd.evVal
+
+    def skipReport(self, geteventCmd):
+        self.slot()
+        self.dontReport = True
+
+    def unknownAbs(self, geteventCmd):
+        self.slot()
+        self.unknown(geteventCmd)
+
+    def report(self, geteventCmd):
+        if self.currentSlot is not None:
+            self.currentSlot.timestamp = geteventCmd.timestamp
+            self.listMotions.append(self.currentSlot)
+            self.currentSlot = self.currentSlot.clone()
+        parcel = None
+        if self.dontReport:
+            self.dontReport = False
         else:
-            print("[WARN] TypeA MT skips unknown line:" + str(geteventCmd))
+            parcel = PipelineParcel()
+            parcel.enqueue(self.listMotions)
+        self.listMotions = []
         return parcel
 
+    def mtReport(self, geteventCmd):
+        if self.currentSlot is not None:
+            self.currentSlot.timestamp = geteventCmd.timestamp
+            self.listMotions.append(self.currentSlot)
+            self.currentSlot = None
+
+    def getState(self):
+        return (self.currentSlot, self.listMotions, self.dontReport, self.unknownCounts)
+
+    def setState(self, state):
+        (self.currentSlot, self.listMotions, self.dontReport, self.unknownCounts) = state
 
-class MultiTouchTypeBParser(PipelineComponent):
+
+class MultiTouchTypeBParser(EventDispatcher):
     """ A type-B multi-touch screen
     a list of supported features:
     MT_PRESSURE, MT_POSITION_X, MT_POSITION_Y, TRACKING_ID, SLOT, TOUCH_MAJOR
     unsupported:
     ABS_MT_TOUCH_MINOR, ABS_MT_WIDTH_MAJOR, ABS_MT_WIDTH_MINOR, ABS_MT_DISTANCE
     ABS_MT_ORIENTATION, ABS_MT_TOOL_X, ABS_MT_TOOL_Y
+    By default every active slot is produced on its own at each SYN_REPORT.
+    With groupReports, a SYN_REPORT produces a single list holding a snapshot
+    of all active slots, the same as MultiTouchTypeAParser, which is what
+    FingerDecomposer expects
     """
     NAVIGATION_HEIGHT = 48  # the standard navigation bar at the bottom
+    LABEL = "Type B MT"
+    HANDLERS = {
+        (EventCodes.EV_ABS, _ABS["ABS_MT_SLOT"]): "setSlot",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_POSITION_X"]): "setX",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_POSITION_Y"]): "setY",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_TRACKING_ID"]): "setTrackingId",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_PRESSURE"]): "setPressure",
+        (EventCodes.EV_ABS, _ABS["ABS_MT_TOUCH_MAJOR"]): "setTouchMajor",
+        (EventCodes.EV_SYN, _SYN["SYN_REPORT"]): "report",
+    }
 
-    def __init__(self):
+    def __init__(self, groupReports=False):
+        EventDispatcher.__init__(self)
+        self.groupReports = groupReports
         # states
         self.currentSlotIndex = 0
         self.currentSlot = MotionEvent()
         self.slots = [self.currentSlot]
 
-    def next(self, geteventCmd):
-        """ Takes a stream of getevent commands and produce motion events
-        """
+    def setSlot(self, geteventCmd):
+        self.currentSlotIndex = geteventCmd.evVal
+        # slots may be met in any order, e.g. when parsing starts mid-trace
+        while geteventCmd.evVal >= len(self.slots):
+            self.slots.append(MotionEvent())
+        self.currentSlot = self.slots[self.currentSlotIndex]
+
+    def setX(self, geteventCmd):
+        self.currentSlot.x = geteventCmd.evVal
+
+    def setY(self, geteventCmd):
+        self.currentSlot.y = geteventCmd.evVal
+
+    def setTrackingId(self, geteventCmd):
+        if geteventCmd.evVal == 0xFFFFFFFF:
+            # unbinding
+            self.slots[self.currentSlotIndex] = MotionEvent()
+        else:
+            # binding tracking_id to slot
+            self.currentSlot.tracking_id = geteventCmd.evVal
+
+    def setPressure(self, geteventCmd):
+        self.currentSlot.pressure = geteventCmd.evVal
+
+    def setTouchMajor(self, geteventCmd):
+        self.currentSlot.touch_major = geteventCmd.evVal
+
+    def report(self, geteventCmd):
         parcel = PipelineParcel()
-        if geteventCmd.evType == "EV_ABS":
-            if geteventCmd.evCmd == "ABS_MT_SLOT":
-                self.currentSlotIndex = geteventCmd.evVal
-                if geteventCmd.evVal >= len(self.slots):
-                    self.slots.extend([None] * (geteventCmd.evVal + 1 - len(self.slots)))
-                    self.slots[geteventCmd.evVal] = MotionEvent()
-                self.currentSlot = self.slots[self.currentSlotIndex]
-            elif geteventCmd.evCmd == "ABS_MT_POSITION_X":
-                self.currentSlot.x = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_POSITION_Y":
-                self.currentSlot.y = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_TRACKING_ID":
-                if geteventCmd.evVal == 0xFFFFFFFF:
-                    # unbinding
-                    self.slots[self.currentSlotIndex] = MotionEvent()
-                else:
-                    # binding tracking_id to slot
-                    self.currentSlot.tracking_id = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_PRESSURE":
-                self.currentSlot.pressure = geteventCmd.evVal
-            elif geteventCmd.evCmd == "ABS_MT_TOUCH_MAJOR":
-                self.currentSlot.touch_major = geteventCmd.evVal
-            else:
-                print("[WARN] Type B MT meets unknown evCmd" + str(geteventCmd))
-        elif geteventCmd.evType == "EV_SYN":
-            if geteventCmd.evCmd == "SYN_REPORT":
-                for motionEvent in self.slots:
-                    if motionEvent.tracking_id != 0xFFFFFFFF:
-                        motionEvent.timestamp = geteventCmd.timestamp
-                        parcel.enqueue(motionEvent)
-            else:
-                print("[WARN] Type B MT meets unknown evCmd" + str(geteventCmd))
+        if self.groupReports:
+            report = []
+            for motionEvent in self.slots:
+                if motionEvent is not None and motionEvent.tracking_id != 0xFFFFFFFF:
+                    motionEvent.timestamp = geteventCmd.timestamp
+                    report.append(motionEvent.clone())
+            parcel.enqueue(report)
         else:
-            print("[WARN] Type B MT skips unknown line:" + str(geteventCmd))
+            for motionEvent in self.slots:
+                if motionEvent.tracking_id != 0xFFFFFFFF:
+                    motionEvent.timestamp = geteventCmd.timestamp
+                    parcel.enqueue(motionEvent)
         return parcel
 
-class DeviceAdjuster(PipelineComponent):
+    def getState(self):
+        return (self.currentSlotIndex, self.currentSlot, self.slots, self.unknownCounts)
+
+    def setState(self, state):
+        (self.currentSlotIndex, self.currentSlot, self.slots, self.unknownCounts) = state
+
+class DeviceAdjuster(MapComponent):
     """ The adjuster will map evdev coordinate system to pixels
     """
     def __init__(self, dev):
@@ -198,15 +445,13 @@ class DeviceAdjuster(PipelineComponent):
         self.ymin = ym["min"]
         self.ymax = ym["max"]
 
-    def next(self, listMotionEvent):
+    def map(self, listMotionEvent):
         """ Take a stream a motion events and produce adjusted motion events
         """
-        parcel = PipelineParcel()
         for e in listMotionEvent:
             e.x = (e.x - self.xmin) * self.dev.displayWidth / (self.xmax - self.xmin)
             e.y = (e.y - self.ymin) * self.dev.displayHeight / (self.ymax - self.ymin)
-        parcel.enqueue(listMotionEvent)
-        return parcel
+        return listMotionEvent
 
 class GenericPrinter(PipelineComponent):
     """ A generic printer, print whatever given
@@ -216,32 +461,492 @@ class GenericPrinter(PipelineComponent):
         """ Takes whatever object and print its string representation
         """
         print(str(whatever))
-        return PipelineParcel()
+        return PipelineParcel.EMPTY
+
+
+class TrailStatistics(PipelineComponent):
+    """ Summarize finger trails: how many trails and motion events, how many
+    of the trails are taps (a single motion event) and their total duration
+    """
+
+    def __init__(self):
+        self.trails = 0
+        self.events = 0
+        self.taps = 0
+        self.duration = 0.0
+
+    def next(self, trail):
+        """ Takes a finger trail and produces nothing
+        """
+        self.trails += 1
+        self.events += len(trail)
+        if len(trail) == 1:
+            self.taps += 1
+        self.duration += trail[-1].timestamp - trail[0].timestamp
+        return PipelineParcel.EMPTY
+
+    def getResult(self):
+        return {"trails": self.trails, "events": self.events,
+                "taps": self.taps, "duration": self.duration}
 
 
 class TextFileLineReader(PipelineComponent):
-    """ A text file reader which reads the file line by line
+    """ A text file reader which reads the file line by line. Compressed
+    traces (.gz, .bz2, .xz) are decompressed on the fly, see openTrace.
+    With decodeThread, a helper thread reads (and decompresses) blocks of
+    lines ahead, so that this overlaps with the following stages.
+    With startTime, reading starts at the first report at or after it,
+    found through the TraceIndex of the trace
     """
 
-    def __init__(self, tracePath):
-        self.fp = open(tracePath)
+    def __init__(self, tracePath, decodeThread=False, startTime=None):
+        self.fp = openTrace(tracePath)
+        if startTime is not None:
+            offset = TraceIndex(tracePath).offsetAt(startTime)
+            if offset is None:
+                self.fp.close()
+            else:
+                self.fp.seek(offset)
+        if decodeThread and not self.fp.closed:
+            self.fp = PrefetchingFile(self.fp)
 
     def next(self, dummy):
         """ Takes nothing and produces lines from the file
         """
         parcel = PipelineParcel()
+        if self.fp.closed:
+            return parcel
         line = self.fp.readline()
         if line != "":
             parcel.enqueue(line)
+        else:
+            self.fp.close()
         return parcel
 
+    def __iter__(self):
+        """ Iterate over the remaining lines, as the source of a PullPipeline
+        """
+        if self.fp.closed:
+            return iter(())
+        return iter(self.fp)
+
+    def getState(self):
+        if self.fp.closed:
+            return None
+        return self.fp.tell()
+
+    def setState(self, offset):
+        if offset is not None:
+            self.fp.seek(offset)
+
+
+class TextTraceWriter(PipelineComponent):
+    """ A sink writing a text trace, compressed according to its extension
+    as in openTrace. It takes lines, which are written as they are, or
+    getevent commands, which are written in the `getevent -lt` format, or
+    with numeric, in the `getevent -t` format. Labels and numbers are
+    converted with EventCodes as needed
+    """
+
+    def __init__(self, tracePath, numeric=False):
+        self.fp = openTrace(tracePath, "w")
+        self.numeric = numeric
+
+    def next(self, obj):
+        if isinstance(obj, GeteventCommand):
+            (evType, evCmd) = (obj.evType, obj.evCmd)
+            if self.numeric:
+                if isinstance(evType, str):
+                    evType = EventCodes.typeNumber(evType)
+                    evCmd = EventCodes.codeNumber(evCmd, evType)
+                obj = "[%15.6f] %04x %04x %08x\n" % (obj.timestamp, evType, evCmd, obj.evVal)
+            else:
+                (evType, evCmd) = _label(evType, evCmd)
+                obj = "[%15.6f] %-12s %-20s %08x\n" % (obj.timestamp, evType, evCmd, obj.evVal)
+        self.fp.write(obj)
+        return PipelineParcel.EMPTY
+
+    def handleEOF(self):
+        self.fp.close()
+        return PipelineComponent.handleEOF(self)
+
+
+# the extensions openTrace decompresses on the fly
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz")
+
+
+def openTrace(path, mode="r"):
+    """ Open a text trace for reading ("r") or writing ("w"), or as bytes
+    ("rb", "wb"). A trace whose
+    name ends in .gz, .bz2 or .xz is compressed or decompressed on the fly,
+    block by block, without a temporary file
+    """
+    lower = path.lower()
+    if lower.endswith(".gz"):
+        import gzip
+        (module, fileClass) = (gzip, gzip.GzipFile)
+    elif lower.endswith(".bz2"):
+        import bz2
+        (module, fileClass) = (bz2, bz2.BZ2File)
+    elif lower.endswith(".xz"):
+        import lzma
+        (module, fileClass) = (lzma, lzma.LZMAFile)
+    else:
+        return open(path, mode)
+    if _NEWLINE == "\n" or "b" in mode:
+        # Python 2 reads and writes str as is
+        return fileClass(path, mode.replace("b", "") + "b")
+    return module.open(path, mode + "t")
+
+
+class PrefetchingFile:
+    """ Read the lines of a file on a helper thread, blockBytes at a time,
+    keeping up to capacity blocks ahead of the reader. It provides the
+    readline, iteration and close of a file; tell and seek count lines, and
+    seek can only skip forward
+    """
+
+    def __init__(self, fp, blockBytes=65536, capacity=8):
+        self.fp = fp
+        self.blockBytes = blockBytes
+        self.queue = Queue.Queue(capacity)
+        self.block = []
+        self.pos = 0
+        self.lineNo = 0
+        self.eof = False
+        self.closed = False
+        self.finished = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            try:
+                while not self.closed:
+                    lines = self.fp.readlines(self.blockBytes)
+                    self.queue.put(lines)
+                    if not lines:
+                        break
+            except Exception:
+                self.queue.put(sys.exc_info()[1])
+        finally:
+            self.finished = True
+
+    def readline(self):
+        if self.pos >= len(self.block):
+            if self.eof or self.closed:
+                return ""
+            block = self.queue.get()
+            if isinstance(block, Exception):
+                self.eof = True
+                raise block
+            if not block:
+                self.eof = True
+                return ""
+            self.block = block
+            self.pos = 0
+        line = self.block[self.pos]
+        self.pos += 1
+        self.lineNo += 1
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if line == "":
+                return
+            yield line
+
+    def tell(self):
+        return self.lineNo
+
+    def seek(self, lineNo):
+        if lineNo < self.lineNo:
+            raise IOError("PrefetchingFile can only seek forward")
+        while self.lineNo < lineNo and self.readline() != "":
+            pass
+
+    def close(self):
+        """ Stop the helper thread and close the file
+        """
+        if self.closed:
+            return
+        self.closed = True
+        # unblock the helper if it waits for room in the queue
+        while not self.finished:
+            try:
+                self.queue.get(True, 0.05)
+            except Queue.Empty:
+                pass
+        self.fp.close()
+
+
+class MappedTraceReader(PipelineComponent):
+    """ A trace reader which memory-maps the file and finds line boundaries
+    directly in the mapped buffer. Every pull produces a single line, as
+    TextFileLineReader does, or with chunkBytes, a list of whole lines of
+    about chunkBytes in total. With views, a line (or a chunk, as a whole)
+    is a zero-copy memoryview slice of the map instead, valid until it is
+    released; the map is closed on the pull after the last view, unless
+    views are still held by then.
+    start and end select a byte range: the reader produces every line that
+    begins in [start, end), so consecutive ranges split a file among workers
+    without losing or repeating a line. With startTime, the range begins at
+    the first report at or after it, found through the TraceIndex of the
+    trace. Lines keep their original line endings. It needs the mmap module
+    of CPython
+    """
+
+    def __init__(self, tracePath, start=0, end=None, chunkBytes=0, views=False,
+                 startTime=None):
+        import mmap
+        self.chunkBytes = chunkBytes
+        self.views = views
+        fp = open(tracePath, "rb")
+        try:
+            size = os.fstat(fp.fileno()).st_size
+            self.mm = None
+            if size > 0:
+                self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        if end is None or end > size:
+            end = size
+        self.end = end
+        if startTime is not None:
+            offset = TraceIndex(tracePath).offsetAt(startTime)
+            if offset is None:
+                offset = size
+            start = max(start, offset)
+        self.pos = self._lineStart(start)
+        if self.pos >= self.end:
+            self.close()
+
+    def _lineStart(self, offset):
+        """ The offset of the first line that begins at or after offset
+        """
+        if offset <= 0:
+            return 0
+        if self.mm is None or self.mm[offset - 1:offset] == _NEWLINE:
+            return offset
+        return self._lineEnd(offset)
+
+    def _lineEnd(self, offset):
+        """ The offset right after the line that contains offset
+        """
+        newline = self.mm.find(_NEWLINE, offset)
+        if newline < 0:
+            return len(self.mm)
+        return newline + 1
+
+    def next(self, dummy):
+        """ Takes nothing and produces a line, or a chunk of lines
+        """
+        if self.mm is None:
+            return PipelineParcel.EMPTY
+        pos = self.pos
+        if pos >= self.end:
+            self.close()
+            return PipelineParcel.EMPTY
+        if self.chunkBytes:
+            cut = self._lineEnd(min(pos + self.chunkBytes, self.end) - 1)
+        else:
+            cut = self._lineEnd(pos)
+        self.pos = cut
+        if self.views:
+            data = memoryview(self.mm)[pos:cut]
+        elif self.chunkBytes:
+            data = [_text(line) for line in self.mm[pos:cut].splitlines(True)]
+        else:
+            data = _text(self.mm[pos:cut])
+        # views of the last lines are still in use until the next pull
+        if cut >= self.end and not self.views:
+            self.close()
+        return PipelineParcel((data,))
+
+    def __iter__(self):
+        """ Iterate over the remaining lines, as the source of a PullPipeline
+        """
+        while self.mm is not None:
+            pos = self.pos
+            self.pos = self._lineEnd(pos)
+            line = _text(self.mm[pos:self.pos])
+            if self.pos >= self.end:
+                self.close()
+            yield line
+
+    def close(self):
+        """ Unmap the file, unless views of it are still in use
+        """
+        mm = self.mm
+        self.mm = None
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                print("[WARN] MappedTraceReader: views are still in use, the map is closed once they are released")
+
+    def getState(self):
+        return self.pos
+
+    def setState(self, pos):
+        self.pos = pos
+
+
+class TraceIndex:
+    """ A sparse index of a text trace, to seek to a point in time without
+    parsing what precedes it. It records the timestamp and byte offset of
+    a report (the lines up to a SYN_REPORT) every interval seconds, and
+    refines a lookup by scanning the reports from the closest entry. The
+    index is kept next to the trace, in tracePath + ".idx", and rebuilt
+    once the trace changes. Timestamps are expected to increase along the
+    trace, as getevent prints them. Offsets in compressed traces are
+    decompressed ones
+    """
+    HEADER = "# MonkeyHelper trace index 1"
+
+    def __init__(self, tracePath, interval=1.0):
+        self.tracePath = tracePath
+        self.indexPath = tracePath + ".idx"
+        self.interval = interval
+        self.timestamps = []
+        self.offsets = []
+        stat = os.stat(tracePath)
+        # the whole mtime, a trace rewritten within a second changes it too
+        self.signature = "%s %d %r %r" % (TraceIndex.HEADER, stat.st_size,
+                                          stat.st_mtime, interval)
+        if not self._load():
+            self._build()
+            self._save()
+
+    def _load(self):
+        try:
+            fp = open(self.indexPath)
+        except IOError:
+            return False
+        try:
+            if fp.readline().rstrip("\n") != self.signature:
+                return False
+            try:
+                for line in fp:
+                    (timestamp, offset) = line.split()
+                    self.timestamps.append(float(timestamp))
+                    self.offsets.append(int(offset))
+            except ValueError:
+                self.timestamps = []
+                self.offsets = []
+                return False
+        finally:
+            fp.close()
+        return True
+
+    def _build(self):
+        due = None
+        for (timestamp, offset) in self.reports(0):
+            if due is None or timestamp >= due:
+                self.timestamps.append(timestamp)
+                self.offsets.append(offset)
+                due = timestamp + self.interval
+
+    def _save(self):
+        try:
+            fp = open(self.indexPath, "w")
+            try:
+                fp.write(self.signature + "\n")
+                for i in range(len(self.offsets)):
+                    fp.write("%r %d\n" % (self.timestamps[i], self.offsets[i]))
+            finally:
+                fp.close()
+        except (IOError, OSError):
+            print("[WARN] TraceIndex cannot save " + self.indexPath)
+
+    def reports(self, offset):
+        """ Iterate over (timestamp, offset) of the reports from offset on
+        """
+        fp = openTrace(self.tracePath, "rb")
+        try:
+            fp.seek(offset)
+            start = offset
+            timestamp = None
+            while True:
+                line = fp.readline()
+                if not line:
+                    break
+                if timestamp is None:
+                    timestamp = _lineTimestamp(line)
+                offset += len(line)
+                if _isSynReport(line):
+                    if timestamp is not None:
+                        yield (timestamp, start)
+                    start = offset
+                    timestamp = None
+            if timestamp is not None:
+                yield (timestamp, start)
+        finally:
+            fp.close()
+
+    def offsetAt(self, timestamp):
+        """ The offset of the first report at or after timestamp, or None if
+        there is none
+        """
+        if not self.offsets:
+            return None
+        i = max(bisect.bisect_right(self.timestamps, timestamp) - 1, 0)
+        for (t, offset) in self.reports(self.offsets[i]):
+            if t >= timestamp:
+                return offset
+        return None
+
+
+def _lineTimestamp(line):
+    close = line.find(_CLOSING)
+    if line[:1] != _OPENING or close < 0:
+        return None
+    try:
+        return float(line[1:close])
+    except ValueError:
+        return None
+
+
+_NEWLINE = "\n".encode("ascii")
+_OPENING = "[".encode("ascii")
+_CLOSING = "]".encode("ascii")
+_SYN_REPORT = "SYN_REPORT".encode("ascii")
+# how `getevent -t` prints a SYN_REPORT
+_NUMERIC_SYN_REPORT = "] 0000 0000 00000000".encode("ascii")
+
+
+def _isSynReport(line):
+    """ Whether a line (bytes) of a labelled or numeric trace is a SYN_REPORT
+    """
+    return _SYN_REPORT in line or line.rstrip().endswith(_NUMERIC_SYN_REPORT)
+
+if _NEWLINE == "\n":
+    def _text(data):
+        return data
+else:
+    def _text(data):
+        return data.decode("latin-1")
+
 
 class RawTraceParser(PipelineComponent):
     """ A trace parser for raw getevent traces
+    The fast path splits a line at its first "]" and at the "." of the
+    timestamp. The seconds of the timestamp and the rest of the line after
+    the "]" repeat a lot across a trace, so each distinct one is checked
+    once by a regex and then looked up in a cache. Any line the fast path
+    does not recognize goes through the full regex, so both ways produce
+    identical commands
     """
+    MAX_CACHED_TAILS = 65536
 
-    def __init__(self):
+    def __init__(self, fastPath=True):
         self.pattern = re.compile("\\[\s*(\d+\.\d+)\\]\s*(\w+)\s*(\w+)\s*(\w+)")
+        self.fastPath = fastPath
+        self.tails = {}
+        self.secondPattern = re.compile("\\[\s*\d+")
+        self.seconds = {}
 
     def next(self, line):
         """ Takes a single line of the raw trace and produces a getevent command object
@@ -249,7 +954,87 @@ class RawTraceParser(PipelineComponent):
         time(float) evType(str) evCmd(str) evVal(int)
         refer to the Linux evdev doc for details
         here we assume the line is dumped from `getevent -lt <EVDEV>
+        A list of lines (e.g. from a Batcher) produces all their commands
+        """
+        if isinstance(line, list):
+            return PipelineParcel(self.parseLines(line))
+        return PipelineParcel((self.parseLine(line),))
+
+    def parseLines(self, lines):
+        """ Parse a list of lines into a list of getevent commands
+        """
+        if not self.fastPath:
+            return [self._parseWithRegex(line) for line in lines]
+        tails = self.tails
+        seconds = self.seconds
+        commands = []
+        append = commands.append
+        for line in lines:
+            (head, sep, rest) = line.partition("]")
+            tail = tails.get(rest)
+            (second, dot, fraction) = head.partition(".")
+            if tail is None or second not in seconds or not fraction.isdigit():
+                append(self.parseLine(line))
+                continue
+            e = GeteventCommand()
+            try:
+                e.timestamp = float(head[1:])
+            except ValueError:
+                append(self._parseWithRegex(line))
+                continue
+            (e.evType, e.evCmd, e.evVal) = tail
+            append(e)
+        return commands
+
+    def parseLine(self, line):
+        """ Parse a single line into a getevent command
+        """
+        if not self.fastPath:
+            return self._parseWithRegex(line)
+        (head, sep, rest) = line.partition("]")
+        (second, dot, fraction) = head.partition(".")
+        if not fraction.isdigit() or \
+                (second not in self.seconds and not self._parseSecond(second)):
+            return self._parseWithRegex(line)
+        e = GeteventCommand()
+        try:
+            e.timestamp = float(head[1:])
+        except ValueError:
+            return self._parseWithRegex(line)
+        tail = self.tails.get(rest)
+        if tail is None:
+            tail = self._parseTail(rest)
+            if tail is None:
+                return self._parseWithRegex(line)
+        (e.evType, e.evCmd, e.evVal) = tail
+        return e
+
+    def _parseSecond(self, second):
+        """ Check and cache what precedes the "." of the timestamp, i.e. "["
+        and the seconds, which are shared by many lines in a row
         """
+        m = self.secondPattern.match(second)
+        if m is None or m.end() != len(second):
+            return False
+        if len(self.seconds) >= RawTraceParser.MAX_CACHED_TAILS:
+            self.seconds.clear()
+        self.seconds[second] = True
+        return True
+
+    def _parseTail(self, tail):
+        """ Parse and cache what follows the timestamp, with the regex itself
+        so that the fast path accepts exactly what the regex accepts
+        """
+        m = self.pattern.match("[0.0]" + tail)
+        if m is None:
+            return None
+        if len(self.tails) >= RawTraceParser.MAX_CACHED_TAILS:
+            self.tails.clear()
+        fields = (m.group(2), m.group(3), _parseValue(m.group(4)))
+        self.tails[tail] = fields
+        return fields
+
+    def _parseWithRegex(self, line):
         m = self.pattern.match(line)
         e = GeteventCommand()
         if m is None:
@@ -258,23 +1043,91 @@ class RawTraceParser(PipelineComponent):
         e.timestamp = float(m.group(1))
         e.evType = m.group(2)
         e.evCmd = m.group(3)
-        if m.group(4) == "DOWN":
-            e.evVal = 1  # TODO special cases for BTN_TOUCH
-        elif m.group(4) == "UP":
-            e.evVal = 0
-        else:
-            e.evVal = int(m.group(4), 16)
-        parcel = PipelineParcel()
-        parcel.enqueue(e)
-        return parcel
+        e.evVal = _parseValue(m.group(4))
+        return e
 
 
-class FingerDecomposer(PipelineComponent):
-    """ Decompose motion event stream into finger trails
+def _parseValue(value):
+    if value == "DOWN":
+        return 1  # TODO special cases for BTN_TOUCH
+    elif value == "UP":
+        return 0
+    else:
+        return int(value, 16)
+
+
+class NumericTraceParser(PipelineComponent):
+    """ A trace parser for numeric getevent traces, dumped by `getevent -t <EVDEV>`
+    a line is in the format of:
+    [time(float)] evType(hex) evCmd(hex) evVal(hex)
+    The commands carry the kernel numbers of their type and code (see
+    EventCodes) rather than labels, and both multi-touch parsers take them
+    as they are. What follows the timestamp repeats a lot across a trace, so
+    each distinct one is parsed once and then looked up in a cache
     """
+    MAX_CACHED_TAILS = 65536
 
     def __init__(self):
+        self.pattern = re.compile("\s*([0-9a-fA-F]{1,4})\s+([0-9a-fA-F]{1,4})\s+([0-9a-fA-F]{1,8})\s*$")
+        self.tails = {}
+
+    def next(self, line):
+        """ Takes a single line of the numeric trace and produces a getevent command
+        A list of lines (e.g. from a Batcher) produces all their commands
+        """
+        if isinstance(line, list):
+            return PipelineParcel(self.parseLines(line))
+        return PipelineParcel((self.parseLine(line),))
+
+    def parseLines(self, lines):
+        """ Parse a list of lines into a list of getevent commands
+        """
+        return [self.parseLine(line) for line in lines]
+
+    def parseLine(self, line):
+        """ Parse a single line into a getevent command
+        """
+        (head, sep, rest) = line.partition("]")
+        tail = self.tails.get(rest)
+        if tail is None:
+            tail = self._parseTail(rest)
+        (second, dot, fraction) = head[1:].partition(".")
+        if tail is None or head[:1] != "[" or not fraction.isdigit() or \
+                not second.strip().isdigit():
+            print("[ERROR] unidentified numeric trace line:" + line)
+            sys.exit()
+        e = GeteventCommand()
+        e.timestamp = float(head[1:])
+        (e.evType, e.evCmd, e.evVal) = tail
+        return e
+
+    def _parseTail(self, tail):
+        m = self.pattern.match(tail)
+        if m is None:
+            return None
+        if len(self.tails) >= NumericTraceParser.MAX_CACHED_TAILS:
+            self.tails.clear()
+        fields = (int(m.group(1), 16), int(m.group(2), 16), int(m.group(3), 16))
+        self.tails[tail] = fields
+        return fields
+
+
+# the version of what the parsers and FingerDecomposer produce from a trace,
+# to be bumped whenever a change alters it, so that cached trails expire
+PARSER_VERSION = 1
+
+
+class FingerDecomposer(PipelineComponent):
+    """ Decompose motion event stream into finger trails. The trails are
+    lists of motion events, or with compactTrails, Trails, which are much
+    smaller when many trails are kept
+    """
+
+    def __init__(self, compactTrails=False):
         self.tracker = {}
+        self.trailClass = list
+        if compactTrails:
+            self.trailClass = Trail
 
     def next(self, listMotionEvents):
         """ Takes a list of motion events and produces finger trails
@@ -288,22 +1141,25 @@ class FingerDecomposer(PipelineComponent):
                 del prev[e.tracking_id]
                 alive[e.tracking_id] = t
             else:
-                alive[e.tracking_id] = [e]
+                alive[e.tracking_id] = self.trailClass([e])
         self.tracker = alive
-        parcel = PipelineParcel()
-        for specialEvent in prev.values():
-            parcel.enqueue(specialEvent)
-        return parcel
+        if not prev:
+            return PipelineParcel.EMPTY
+        return PipelineParcel(prev.values())
     def handleEOF(self):
-        parcel = PipelineParcel()
-        for e in self.tracker.values():
-            parcel.enqueue(e)
+        parcel = PipelineParcel(self.tracker.values())
         self.tracker = {}
         parcel.enqueue(Pipeline.EOF)
         return parcel
 
+    def getState(self):
+        return self.tracker
+
+    def setState(self, tracker):
+        self.tracker = tracker
 
-class TrailScaler(PipelineComponent):
+
+class TrailScaler(MapComponent):
     """ Scale the coordinates of the motion events in the trail
     Used to adapt the trail from one device to another with a different resolution
     """
@@ -320,43 +1176,43 @@ class TrailScaler(PipelineComponent):
         motionEvent.x = tempXValue
         motionEvent.y = tempYValue
 
-    def next(self, specialEvent):
+    def map(self, specialEvent):
         """ Takes a specialEvent and produces a scaled specialEvent with given factors
         """
         for e in specialEvent:
             self.scaleXY(e)
-        parcel = PipelineParcel()
-        parcel.enqueue(specialEvent)
-        return parcel
+        return specialEvent
 
 
-class TimeScaler(PipelineComponent):
+class TimeScaler(MapComponent):
     """ Scale the time of a trail, e.g. accelerate/decelerate the replaying
     """
 
     def __init__(self, factor):
         self.factor = factor
 
-    def next(self, specialEvent):
+    def map(self, specialEvent):
         """ Takes a specialEvent and produces a time-scaled specialEvent
         """
         for e in specialEvent:
             e.timestamp *= self.factor
-        parcel = PipelineParcel()
-        parcel.enqueue(specialEvent)
-        return parcel
+        return specialEvent
 
 
-class RelativeTimingConverter(PipelineComponent):
+class RelativeTimingConverter(MapComponent):
     """ Convert all timestamp based on the first one in the trace
     """
     baseTimestamp = None
 
-    def next(self, listMotionEvents):
+    def map(self, listMotionEvents):
         if self.baseTimestamp is None:
             self.baseTimestamp = listMotionEvents[0].timestamp
         for e in listMotionEvents:
             e.timestamp -= self.baseTimestamp
-        parcel = PipelineParcel()
-        parcel.enqueue(listMotionEvents)
-        return parcel
+        return listMotionEvents
+
+    def getState(self):
+        return self.baseTimestamp
+
+    def setState(self, baseTimestamp):
+        self.baseTimestamp = baseTimestamp
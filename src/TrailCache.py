@@ -0,0 +1,298 @@
+#
+# Copyright 2014 Mingyuan Xia (http://mxia.me) and others
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Contributors:
+#   Mingyuan Xia
+#
+
+"""
+This module keeps the finger trails of parsed traces on disk, so that
+analyzing a trace again skips the parsing. An entry is keyed by the SHA-1
+of the trace file, the multi-touch protocol (A or B) and
+TraceManipulation.PARSER_VERSION. It holds the trails FingerDecomposer
+produced, in order, column by column as in a Trail:
+    a header: magic "MHTC", format version and number of trails
+    per trail: the number of motion events, then per column its array
+    typecode, item size and raw little-endian items
+The cache is bounded in size: once it grows beyond maxBytes, the least
+recently used entries (by modification time, which a hit renews) are
+removed.
+"""
+
+import os, sys, struct, array, hashlib
+from Pipeline import PipelineComponent, PipelineParcel
+from TraceManipulation import Trail, PARSER_VERSION
+
+MAGIC = "MHTC".encode("ascii")
+VERSION = 1
+HEADER = struct.Struct("<4sHI")
+COLUMN = struct.Struct("<cB")
+COUNT = struct.Struct("<I")
+SUFFIX = ".trails"
+
+# bytes hashed at a time
+HASH_BLOCK = 1 << 20
+
+
+class TrailCache:
+    """ A directory of cached trails, bounded to maxBytes
+    """
+
+    def __init__(self, directory, maxBytes=256 << 20):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        # content hashes of the traces seen, by (path, size, mtime)
+        self.hashes = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, tracePath, parserType):
+        """ The name of the entry of a trace parsed with an MT parser type
+        """
+        stat = os.stat(tracePath)
+        signature = (os.path.abspath(tracePath), stat.st_size, stat.st_mtime)
+        digest = self.hashes.get(signature)
+        if digest is None:
+            digest = _hashFile(tracePath)
+            self.hashes[signature] = digest
+        return "%s-%s-v%d%s" % (digest, parserType, PARSER_VERSION, SUFFIX)
+
+    def load(self, key):
+        """ The trails of an entry, as Trails, or None if it is not cached
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            fp = open(path, "rb")
+        except IOError:
+            return None
+        try:
+            try:
+                trails = _readTrails(fp)
+            except (ValueError, struct.error):
+                trails = None
+        finally:
+            fp.close()
+        if trails is None:
+            print("[WARN] TrailCache drops a damaged entry " + key)
+            _remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return trails
+
+    def store(self, key, trails):
+        """ Cache trails (Trails or lists of motion events) under key, then
+        evict the least recently used entries beyond maxBytes
+        """
+        path = os.path.join(self.directory, key)
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        fp = open(temp, "wb")
+        try:
+            try:
+                _writeTrails(fp, trails)
+            finally:
+                fp.close()
+        except (TypeError, OverflowError):
+            print("[WARN] TrailCache cannot store the trails of " + key)
+            _remove(temp)
+            return
+        if os.path.exists(path):
+            _remove(path)
+        os.rename(temp, path)
+        self.evict(key)
+
+    def evict(self, keep=None):
+        """ Remove the least recently used entries, other than keep, until
+        the cache fits in maxBytes
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+            total += stat.st_size
+        entries.sort()
+        for (mtime, name, size) in entries:
+            if total <= self.maxBytes:
+                break
+            if name == keep:
+                continue
+            _remove(os.path.join(self.directory, name))
+            total -= size
+
+
+class CachedTrailReader(PipelineComponent):
+    """ A source producing the finger trails of a trace from a TrailCache,
+    batchTrails at a time. On a miss, parse() is called for an iterable of
+    the trails, e.g. a PullPipeline ending with a FingerDecomposer, and what
+    it yields is produced, while a copy is stored once it is exhausted (the
+    stages downstream may modify the trails they get). parserType is
+    the MT parser type ("A" or "B") parse uses. With compactTrails, the
+    trails are Trails, otherwise lists of motion events
+    """
+
+    def __init__(self, cache, tracePath, parserType, parse, compactTrails=False,
+                 batchTrails=256):
+        self.cache = cache
+        self.key = cache.key(tracePath, parserType)
+        self.compactTrails = compactTrails
+        self.batchTrails = batchTrails
+        self.hit = True
+        trails = cache.load(self.key)
+        if trails is None:
+            self.hit = False
+            self.parsed = []
+            trails = parse()
+        self.trails = iter(trails)
+
+    def next(self, dummy):
+        """ Takes nothing and produces finger trails
+        """
+        if self.trails is None:
+            return PipelineParcel.EMPTY
+        parcel = PipelineParcel()
+        for trail in self.trails:
+            if not self.hit:
+                self.parsed.append(_copyTrail(trail))
+            if self.compactTrails and not isinstance(trail, Trail):
+                trail = Trail(trail)
+            elif not self.compactTrails and isinstance(trail, Trail):
+                trail = [p.clone() for p in trail]
+            parcel.enqueue(trail)
+            if len(parcel) >= self.batchTrails:
+                return parcel
+        self.trails = None
+        if not self.hit:
+            self.cache.store(self.key, self.parsed)
+            self.parsed = None
+        return parcel
+
+
+def _copyTrail(trail):
+    """ A Trail with columns of its own
+    """
+    if not isinstance(trail, Trail):
+        return Trail(trail)
+    copy = Trail()
+    for name in Trail.__slots__:
+        column = getattr(trail, name)
+        if isinstance(column, array.array):
+            column = array.array(column.typecode, column)
+        else:
+            column = list(column)
+        setattr(copy, name, column)
+    return copy
+
+
+def _hashFile(path):
+    digest = hashlib.sha1()
+    fp = open(path, "rb")
+    try:
+        while True:
+            block = fp.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+    finally:
+        fp.close()
+    return digest.hexdigest()
+
+
+def _writeTrails(fp, trails):
+    fp.write(HEADER.pack(MAGIC, VERSION, len(trails)))
+    for trail in trails:
+        if not isinstance(trail, Trail):
+            trail = Trail(trail)
+        fp.write(COUNT.pack(len(trail)))
+        for (name, typecode) in Trail.TYPECODES:
+            column = getattr(trail, name)
+            if not isinstance(column, array.array):
+                column = _widerArray(column)
+            _writeColumn(fp, column)
+
+
+def _widerArray(values):
+    """ An array for a column that outgrew the array of its Trail
+    """
+    for typecode in ("l", "q"):
+        try:
+            return array.array(typecode, values)
+        except (TypeError, OverflowError, ValueError):
+            pass
+    raise OverflowError("no array holds the column")
+
+
+def _writeColumn(fp, column):
+    if sys.byteorder != "little":
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    fp.write(COLUMN.pack(column.typecode.encode("ascii"), column.itemsize))
+    if hasattr(column, "tobytes"):
+        fp.write(column.tobytes())
+    else:
+        fp.write(column.tostring())
+
+
+def _readTrails(fp):
+    (magic, version, count) = HEADER.unpack(_readFully(fp, HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a trail cache entry")
+    trails = []
+    for i in range(count):
+        (length,) = COUNT.unpack(_readFully(fp, COUNT.size))
+        trail = Trail()
+        for (name, typecode) in Trail.TYPECODES:
+            setattr(trail, name, _readColumn(fp, length))
+        trails.append(trail)
+    if fp.read(1):
+        raise ValueError("trailing bytes in a trail cache entry")
+    return trails
+
+
+def _readColumn(fp, length):
+    (typecode, itemsize) = COLUMN.unpack(_readFully(fp, COLUMN.size))
+    column = array.array(typecode.decode("ascii"))
+    if column.itemsize != itemsize:
+        # written on a platform with other array sizes
+        raise ValueError("unsupported trail cache column")
+    data = _readFully(fp, length * itemsize)
+    if hasattr(column, "frombytes"):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def _readFully(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise ValueError("truncated trail cache entry")
+    return data
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -88,11 +88,18 @@ class TroubleInjector(PipelineComponent):
             pass
         self.parcel.enqueue(gestureEvent)
         self.prevGesture = gestureEvent
-        return PipelineParcel()
+        return PipelineParcel.EMPTY
 
     def handleEOF(self):
         return self.parcel
 
+    def getState(self):
+        return (self.prevGesture, self.idx, self.insertionIdx, list(self.parcel.q))
+
+    def setState(self, state):
+        (self.prevGesture, self.idx, self.insertionIdx, queued) = state
+        self.parcel = PipelineParcel(queued)
+
 
 class TroubleReplayer(Replayer):
 
@@ -122,7 +129,7 @@ class TroubleReplayer(Replayer):
         elif isinstance(specialEvent,ReplayEvent):
             self.setTimestamp(specialEvent.timestamp)
             print(self.getTimestamp())
-        return PipelineParcel()
+        return PipelineParcel.EMPTY
 
     def canAccept(self, replayEvent):
         return isinstance(replayEvent, SpecialEvent)